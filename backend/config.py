@@ -1,32 +1,106 @@
 # D:\GNPL-Private\VoiceInvoice\backend\config.py
 
 import os
+import re
+import functools
+from dataclasses import dataclass
+from datetime import timedelta
+from types import MappingProxyType
+
+try:
+    import ahocorasick # Optional (pyahocorasick): single-pass multi-pattern matching for item autofill
+except ImportError:
+    ahocorasick = None
+
+@dataclass(frozen=True, slots=True)
+class AppConfig:
+    """
+    Immutable snapshot of the environment-driven application settings.
+    Populated once per process by get_config().
+    """
+    environment: str
+    log_level: str
+    minio_endpoint: str
+    minio_access_key: str
+    minio_secret_key: str
+    minio_secure: bool
+    minio_audio_bucket: str
+    minio_pdf_bucket: str
+    minio_presigned_downloads: bool
+    cuda_memory_fraction: float
+    torch_compile: bool
+    llm_max_batch_size: int
+    llm_max_wait_ms: float
+
+@functools.lru_cache(maxsize=None)
+def get_config() -> AppConfig:
+    """
+    Reads the environment once and returns the cached AppConfig singleton.
+    Subsequent calls are a plain cache hit and never touch os.environ again.
+    """
+    return AppConfig(
+        # Setting the environment to development by default if not specified
+        environment=os.getenv("ENVIRONMENT", "development"),
+        log_level=os.getenv("LOG_LEVEL", "INFO").upper(), # e.g. DEBUG to include LLM output dumps
+        minio_endpoint=os.getenv("MINIO_ENDPOINT", "localhost:9000"), # MinIO server endpoint
+        minio_access_key=os.getenv("MINIO_ACCESS_KEY", "minioadmin"), # MinIO access key
+        minio_secret_key=os.getenv("MINIO_SECRET_KEY", "minioadmin"), # MinIO secret key
+        minio_secure=os.getenv("MINIO_SECURE", "False").lower() == "true", # Use HTTPS if true, parsed once
+        # Bucket names for audio inputs and generated PDFs
+        minio_audio_bucket=os.getenv("MINIO_AUDIO_BUCKET", "audio-inputs"),
+        minio_pdf_bucket=os.getenv("MINIO_PDF_BUCKET", "generated-invoices"),
+        # Redirect downloads to pre-signed MinIO URLs; requires MINIO_ENDPOINT to be reachable by clients
+        minio_presigned_downloads=os.getenv("MINIO_PRESIGNED_DOWNLOADS", "True").lower() == "true",
+        # Share of each GPU's memory the PyTorch caching allocator may claim
+        cuda_memory_fraction=float(os.getenv("CUDA_MEMORY_FRACTION", "0.9")),
+        # Compile the model's forward pass with torch.compile after loading (GPU only)
+        torch_compile=os.getenv("TORCH_COMPILE", "True").lower() == "true",
+        # Micro-batching of concurrent generate() calls: batch size cap and how long to wait for more requests
+        llm_max_batch_size=int(os.getenv("LLM_MAX_BATCH_SIZE", "8")),
+        llm_max_wait_ms=float(os.getenv("LLM_MAX_WAIT_MS", "25")),
+    )
+
+_CONFIG = get_config()
 
 # --- General Application Configuration ---
-# Setting the environment to development by default if not specified
-ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+ENVIRONMENT = _CONFIG.environment
+LOG_LEVEL = _CONFIG.log_level
 
 # --- Model Configuration ---
 QWEN2_AUDIO_MODEL_NAME = "Qwen/Qwen2-Audio-7B-Instruct" # Name of the pre-trained Qwen2-Audio model
 
+# --- PyTorch CUDA Allocator Configuration ---
+# Default for PYTORCH_CUDA_ALLOC_CONF; must be in the environment before torch is first imported.
+PYTORCH_CUDA_ALLOC_CONF = "expandable_segments:True,max_split_size_mb:512"
+CUDA_MEMORY_FRACTION = _CONFIG.cuda_memory_fraction
+TORCH_COMPILE = _CONFIG.torch_compile
+LLM_MAX_BATCH_SIZE = _CONFIG.llm_max_batch_size
+LLM_MAX_WAIT_MS = _CONFIG.llm_max_wait_ms
+
 # --- MinIO S3 Compatible Storage Configuration ---
-MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000") # MinIO server endpoint
-MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin") # MinIO access key
-MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin") # MinIO secret key
-MINIO_SECURE = os.getenv("MINIO_SECURE", "False").lower() == "true" # Use HTTPS if true
+# Module-level aliases kept so existing `from backend.config import ...` imports keep working.
+MINIO_ENDPOINT = _CONFIG.minio_endpoint
+MINIO_ACCESS_KEY = _CONFIG.minio_access_key
+MINIO_SECRET_KEY = _CONFIG.minio_secret_key
+MINIO_SECURE = _CONFIG.minio_secure
 
 # Bucket names for audio inputs and generated PDFs
-MINIO_AUDIO_BUCKET = os.getenv("MINIO_AUDIO_BUCKET", "audio-inputs")
-MINIO_PDF_BUCKET = os.getenv("MINIO_PDF_BUCKET", "generated-invoices")
+MINIO_AUDIO_BUCKET = _CONFIG.minio_audio_bucket
+MINIO_PDF_BUCKET = _CONFIG.minio_pdf_bucket
+
+# Download endpoints redirect to pre-signed URLs (valid for MINIO_PRESIGNED_URL_EXPIRY) instead of proxying bytes
+MINIO_PRESIGNED_DOWNLOADS = _CONFIG.minio_presigned_downloads
+MINIO_PRESIGNED_URL_EXPIRY = timedelta(minutes=15)
 
 # --- Simulated Local Databases for Autofill (for demonstration/development) ---
 # In a production environment, these would typically be replaced with actual databases (SQL, NoSQL).
-user_db = {
+# Wrapped in read-only proxies so request handlers cannot accidentally mutate the shared data.
+user_db = MappingProxyType({
     "john doe": {"name": "John Doe", "address": "123 Elm St, Springfield, IL", "email": "john.doe@example.com", "default_tax_rate": 0.07},
     "acme corp": {"name": "ACME Corporation", "address": "456 Oak Ave, Metropolis, NY", "email": "info@acmecorp.com", "default_tax_rate": 0.09},
-}
+})
 
-item_db = {
+item_db = MappingProxyType({
     "laptop": {"description": "Laptop Computer", "unit_price": 1200.00},
     "keyboard": {"description": "Mechanical Keyboard", "unit_price": 75.00},
     "mouse": {"description": "Wireless Mouse", "unit_price": 25.00},
@@ -34,10 +108,46 @@ item_db = {
     "consulting services": {"description": "Consulting Services (Hourly)", "unit_price": 150.00},
     "web development": {"description": "Web Development Services", "unit_price": 100.00},
     "graphic design": {"description": "Graphic Design Services", "unit_price": 80.00},
-}
+})
+
+# Normalized lookup tables, built once at import so autofill never re-normalizes the DB keys per request.
+user_db_normalized = MappingProxyType({k.lower().strip(): v for k, v in user_db.items()})
+item_db_normalized = MappingProxyType({k.lower().strip(): v for k, v in item_db.items()})
+
+# Item keys in substring-matching priority: longest (most specific) first, equal lengths in DB order.
+# When a description contains several keys (e.g. "pen" and "pen drive"), the first one in this order wins.
+ITEM_KEYS_BY_PRIORITY = tuple(sorted(item_db_normalized, key=len, reverse=True))
+ITEM_KEY_RANKS = MappingProxyType({db_item: rank for rank, db_item in enumerate(ITEM_KEYS_BY_PRIORITY)})
+
+def _build_item_automaton(ranked_keys=ITEM_KEYS_BY_PRIORITY):
+    """
+    Builds an Aho-Corasick automaton over the normalized item keys.
+    Each key's value is (priority rank, key), so the best of several hits is simply the minimum.
+    Returns None when pyahocorasick is not installed.
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for rank, db_item in enumerate(ranked_keys):
+        automaton.add_word(db_item, (rank, db_item))
+    automaton.make_automaton()
+    return automaton
+
+item_automaton = _build_item_automaton()
+
+def _build_item_pattern(ranked_keys=ITEM_KEYS_BY_PRIORITY):
+    """
+    Builds the regex used for item matching when pyahocorasick is unavailable.
+    The alternation sits in a lookahead, so finditer reports a (longest-first) hit at every position,
+    including overlapping ones; picking the best-ranked hit then follows the same rule as the automaton.
+    Returns None for an empty item DB.
+    """
+    if not ranked_keys:
+        return None
+    return re.compile("(?=(" + "|".join(re.escape(k) for k in ranked_keys) + "))")
+
+ITEM_PATTERN = _build_item_pattern()
 
 # No longer using local file system paths for audio/PDFs directly in services,
 # these are replaced by MinIO buckets.
 # LOCAL_AUDIO_FOLDER and LOCAL_PDF_FOLDER are removed from here.
-
-print(f"Configuration Loaded: Environment={ENVIRONMENT}, MinIO Endpoint={MINIO_ENDPOINT}, Audio Bucket={MINIO_AUDIO_BUCKET}, PDF Bucket={MINIO_PDF_BUCKET}")
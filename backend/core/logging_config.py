@@ -0,0 +1,34 @@
+# backend/core/logging_config.py
+
+import atexit
+import logging
+import logging.handlers
+import queue
+from typing import Optional, Union
+
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: Union[int, str] = logging.INFO) -> None:
+    """
+    Routes all application logging through a QueueHandler, so request handlers only enqueue
+    records while a background QueueListener thread performs the actual stream I/O.
+    Calling it again after the first call is a no-op.
+
+    Args:
+        level (Union[int, str]): Root log level, e.g. logging.INFO or "DEBUG".
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _queue_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.register(_queue_listener.stop) # Flush queued records on interpreter shutdown
@@ -1,19 +1,83 @@
 # backend/core/utils.py
 
-import torch
-import gc
-import re
-import json
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from backend.config import user_db, item_db # These are now mock DBs, kept for autofill logic
-from backend.models import InvoiceData, InvoiceItem, ValidationError # ValidationError for type hinting/catching
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Mapping, Optional
+from backend.config import user_db_normalized, item_db_normalized, item_automaton, ITEM_PATTERN, ITEM_KEY_RANKS # These are now mock DBs, kept for autofill logic
+from backend.models import InvoiceData, InvoiceItem, ValidationError, _finalize_totals, _item_total # ValidationError for type hinting/catching
+
+_THIRTY_DAYS = timedelta(days=30) # Default payment term used for due_date autofill
 
 def clear_gpu_memory():
-    """Clears CUDA memory cache and runs garbage collection."""
+    """
+    Runs garbage collection so unreferenced tensors go back to PyTorch's caching allocator.
+    Cached CUDA blocks are deliberately kept, so the next inference reuses them instead of
+    paying for fresh cudaMalloc calls; use force_release_gpu() to hand them back to the driver.
+    """
+    import gc
+
+    gc.collect()
+
+def force_release_gpu():
+    """
+    Runs garbage collection and releases all cached CUDA blocks back to the driver.
+    Intended for admin/recovery paths (e.g. after a failed model load), not per request.
+    """
+    import torch # Imported lazily so autofill-only users of this module don't load torch
+
+    clear_gpu_memory()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
-    gc.collect()
+
+def _find_item_key(normalized_description: str, automaton=None, pattern=None, key_ranks: Optional[Mapping[str, int]] = None) -> Optional[str]:
+    """
+    Returns the item key contained in the description, or None.
+    Both backends collect every hit and return the highest-priority one: the longest key, and among
+    equally long keys the first in DB order (see config.ITEM_KEYS_BY_PRIORITY). So the chosen item,
+    and with it the autofilled price, doesn't depend on whether pyahocorasick is installed.
+
+    Args:
+        normalized_description (str): Lowercased, stripped item description.
+        automaton: Aho-Corasick automaton from config._build_item_automaton, if available.
+        pattern: Regex from config._build_item_pattern, used when there is no automaton.
+        key_ranks (Optional[Mapping[str, int]]): Priority rank of each key, required with pattern.
+    """
+    if automaton is not None:
+        best = min((value for _, value in automaton.iter(normalized_description)), default=None)
+        return best[1] if best is not None else None
+    if pattern is None:
+        return None
+    return min((match.group(1) for match in pattern.finditer(normalized_description)), key=key_ranks.__getitem__, default=None)
+
+def _match_item(normalized_description: str) -> Optional[Mapping[str, Any]]:
+    """
+    Finds the item_db entry for a normalized item description.
+    Tries an exact key lookup first, then falls back to a single-pass substring scan:
+    an Aho-Corasick automaton when pyahocorasick is available, else a compiled regex alternation.
+    If the description contains several item keys, the longest one wins with either backend
+    (so "pen drive" beats "pen"), rather than the first key in DB order.
+    """
+    db_info = item_db_normalized.get(normalized_description)
+    if db_info is not None:
+        return db_info
+    db_item = _find_item_key(normalized_description, item_automaton, ITEM_PATTERN, ITEM_KEY_RANKS)
+    return item_db_normalized[db_item] if db_item is not None else None
+
+def _parse_invoice_date(value: Optional[str]) -> Optional[date]:
+    """
+    Parses a YYYY-MM-DD date. date.fromisoformat handles the usual zero-padded form;
+    strptime is kept as the fallback for non-padded dates such as "2025-7-4" that it also accepts.
+
+    Returns:
+        Optional[date]: The parsed date, or None if the value is invalid or not set.
+    """
+    try:
+        return date.fromisoformat(value)
+    except (ValueError, TypeError):
+        pass
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return None
 
 def autofill_invoice_data(invoice_data: InvoiceData) -> InvoiceData:
     """
@@ -26,52 +90,49 @@ def autofill_invoice_data(invoice_data: InvoiceData) -> InvoiceData:
     Returns:
         InvoiceData: The updated invoice data with autofilled information.
     """
+    today = datetime.now().date() # Read the clock once for both date defaults
+
     # Create a mutable copy to avoid modifying the original object in place
     # if this function is called on an object that might be reused or
     # that came directly from a FastAPI request body.
-    invoice_data_copy = invoice_data.model_copy(deep=True)
+    # Only the items are mutated per element, so clone those and shallow-copy the rest.
+    invoice_data_copy = invoice_data.model_copy(update={"items": [item.model_copy() for item in invoice_data.items]})
 
     if invoice_data_copy.client_name:
         normalized_client_name = invoice_data_copy.client_name.lower().strip()
-        if normalized_client_name in user_db:
-            client_info = user_db[normalized_client_name]
+        client_info = user_db_normalized.get(normalized_client_name)
+        if client_info is not None:
             if not invoice_data_copy.client_address:
                 invoice_data_copy.client_address = client_info.get("address")
             # Only update tax_rate if it's not explicitly set in the incoming data
             if invoice_data_copy.tax_rate is None or invoice_data_copy.tax_rate == 0.08: # Default value
                 invoice_data_copy.tax_rate = client_info.get("default_tax_rate", 0.08)
 
+    # Single pass over the items: autofill unit_price, recompute the item total, accumulate the subtotal.
+    # The values written here are trusted, so they bypass BaseModel.__setattr__ via object.__setattr__.
+    subtotal_acc = 0.0
     for item in invoice_data_copy.items:
         # If unit_price is missing but description exists, try to autofill
         if not item.unit_price and item.description:
-            normalized_description = item.description.lower().strip()
-            for db_item, db_info in item_db.items():
-                if db_item in normalized_description: # Simple substring match
-                    item.unit_price = db_info.get("unit_price")
-                    # Break after finding the first match
-                    break
-        # Ensure item total is calculated or re-calculated after autofill of unit_price
-        if item.quantity is not None and item.unit_price is not None:
-            item.total = round(item.quantity * item.unit_price, 2)
-        elif item.total is None: # If no quantity/unit_price but total needed
-             item.total = 0.0 # Default to 0 if not enough info
-
-    # Recalculate totals after autofilling item prices and ensure they are not None
-    invoice_data_copy.subtotal = round(sum(item.total for item in invoice_data_copy.items if item.total is not None), 2)
-    effective_tax_rate = invoice_data_copy.tax_rate if invoice_data_copy.tax_rate is not None else 0.0
-    invoice_data_copy.tax_amount = round(invoice_data_copy.subtotal * effective_tax_rate, 2)
-    invoice_data_copy.grand_total = round(invoice_data_copy.subtotal + invoice_data_copy.tax_amount, 2)
+            db_info = _match_item(item.description.lower().strip())
+            if db_info is not None:
+                object.__setattr__(item, "unit_price", db_info.get("unit_price"))
+        # Ensure item total is re-calculated after autofill of unit_price, rounded as on validation
+        item_total = _item_total(item)
+        object.__setattr__(item, "total", item_total)
+        subtotal_acc += item_total
+
+    # Round the subtotal once and derive tax_amount/grand_total from it
+    _finalize_totals(invoice_data_copy, subtotal=round(subtotal_acc, 2))
 
     # Handle dates
+    # ISO-8601 (YYYY-MM-DD) parsing/formatting via the C fast paths instead of strptime/strftime
     if not invoice_data_copy.invoice_date:
-        invoice_data_copy.invoice_date = datetime.now().strftime("%Y-%m-%d")
+        invoice_data_copy.invoice_date = today.isoformat()
     if not invoice_data_copy.due_date:
-        try:
-            invoice_date_dt = datetime.strptime(invoice_data_copy.invoice_date, "%Y-%m-%d")
-            invoice_data_copy.due_date = (invoice_date_dt + timedelta(days=30)).strftime("%Y-%m-%d")
-        except (ValueError, TypeError):
-            # Fallback if invoice_date is invalid or not set
-            invoice_data_copy.due_date = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d")
+        invoice_date_dt = _parse_invoice_date(invoice_data_copy.invoice_date)
+        # Fallback to today if invoice_date is invalid or not set
+        invoice_data_copy.due_date = ((invoice_date_dt or today) + _THIRTY_DAYS).isoformat()
 
 
     return invoice_data_copy
@@ -80,6 +141,8 @@ def check_model_devices(qwen2_audio_model: Optional[Any], device: str) -> str:
     """
     Checks the device placement and memory usage of the Qwen2-Audio model.
     """
+    import torch # Imported lazily, see force_release_gpu
+
     status_output = []
     status_output.append("--- Checking Model Device Placement ---")
 
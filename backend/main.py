@@ -1,25 +1,91 @@
 # backend/main.py
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, status
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import Depends, FastAPI, UploadFile, File, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, RedirectResponse, StreamingResponse
 from typing import Optional
+import asyncio
+import logging
 import os
-import shutil
 import uuid # For generating unique IDs for uploaded files
-from io import BytesIO
 
-from backend.models import InvoiceData
-from backend.config import MINIO_AUDIO_BUCKET, MINIO_PDF_BUCKET
-# Import the llm_service module itself, not its internal global variables directly
-import backend.services.llm_service as llm_service
-from backend.services.pdf_service import generate_invoice_pdf
+from backend.models import InvoiceData, ValidationError
+from backend.config import LOG_LEVEL, MINIO_AUDIO_BUCKET, MINIO_PDF_BUCKET, MINIO_PRESIGNED_DOWNLOADS, PYTORCH_CUDA_ALLOC_CONF
+from backend.services.pdf_service import generate_invoice_pdf_async, start_pdf_process_pool, shutdown_pdf_process_pool
 from backend.core.utils import check_model_devices
-from backend.services.storage_service import minio_storage_service # Import the MinIO service instance
+from backend.core.logging_config import setup_logging
+from backend.services.storage_service import get_minio # Accessor for the shared MinIO service instance
+
+setup_logging(LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+# Configure PyTorch's caching allocator up-front; torch is only imported later, via llm_service.
+# An explicit PYTORCH_CUDA_ALLOC_CONF in the environment takes precedence.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", PYTORCH_CUDA_ALLOC_CONF)
+
+# Content types for audio downloads, keyed by lowercased file extension
+_AUDIO_CT = {
+    ".wav": "audio/wav",
+    ".mp3": "audio/mpeg",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+}
+
+async def _gather_or_cancel(*aws):
+    """
+    Like asyncio.gather, but as soon as one awaitable fails the others are cancelled
+    before the exception is re-raised, so e.g. a failed upload doesn't leave an LLM extraction running.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+def _inline_schema_refs(schema: dict) -> dict:
+    """Resolves the $defs references of a Pydantic JSON schema in place, so it can be embedded in an OpenAPI operation."""
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return resolve(defs[ref[len("#/$defs/"):]])
+            return {key: resolve(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [resolve(value) for value in node]
+        return node
+
+    return resolve(schema)
+
+# Documents the InvoiceData body of endpoints that read it via _invoice_data_body instead of a typed parameter
+_INVOICE_DATA_BODY_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _inline_schema_refs(InvoiceData.model_json_schema())}},
+    }
+}
+
+async def _invoice_data_body(request: Request) -> InvoiceData:
+    """
+    Validates the request body as InvoiceData with context={"defer_totals": True}, for endpoints that
+    call autofill_invoice_data straight away, so the totals are computed once (by autofill) instead of
+    on validation too. Invalid bodies get FastAPI's usual 422 response.
+    """
+    body = await request.body()
+    try:
+        return InvoiceData.model_validate_json(body, context={"defer_totals": True})
+    except ValidationError as e:
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
 
 app = FastAPI(
     title="Voice-Powered Invoice Generator Backend",
     description="API for processing audio requests to generate structured invoice data and PDF invoices, with MinIO storage.",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse # orjson serializes responses in C, notably faster than stdlib json
 )
 
 # Startup event: Initialize MinIO client and ensure buckets exist, load LLM model
@@ -29,18 +95,31 @@ async def startup_event():
     Initializes MinIO client (which in turn ensures buckets exist)
     and loads the Qwen2-Audio LLM model on application startup.
     """
-    print("Application startup: Initializing services...")
+    logger.info("Application startup: Initializing services...")
+    # Worker processes for rendering large invoices (smaller ones are rendered in a thread).
+    # The executor spawns its processes on first use, so this is cheap.
+    start_pdf_process_pool()
     try:
-        # MinIO storage service is instantiated globally in storage_service.py
-        # Its __init__ method will ensure buckets exist.
-        _ = minio_storage_service
-        print("MinIO storage service initialized and buckets ensured.")
+        # Create the shared MinIO storage service now rather than on the first request.
+        # Its __init__ method will ensure buckets exist; the blocking calls run in a worker thread.
+        await asyncio.to_thread(get_minio)
+        logger.info("MinIO storage service initialized and buckets ensured.")
+        # llm_service (and with it torch/transformers) is imported lazily, on first use.
+        # Import the module itself, not its internal global variables directly,
+        # since those are reassigned when the model is loaded.
+        from backend.services import llm_service
         # Call the loading function within the llm_service module
         llm_service.load_qwen2_audio_model()
     except Exception as e:
-        print(f"CRITICAL ERROR during startup: {e}")
+        logger.critical("Error during startup: %s", e)
         # Depending on criticality, you might want to exit or log more severely
-        # For now, just print and allow app to start, but subsequent calls will fail.
+        # For now, just log and allow app to start, but subsequent calls will fail.
+
+# Shutdown event: stop the PDF worker processes
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stops the PDF process pool on application shutdown."""
+    shutdown_pdf_process_pool()
 
 @app.get("/")
 async def root():
@@ -53,6 +132,7 @@ async def load_model_endpoint():
     Explicitly loads the Qwen2-Audio model and processor into memory.
     This can be called if the model failed to load at startup or for re-initialization.
     """
+    from backend.services import llm_service
     # Call the loading function within the llm_service module
     status_message = llm_service.load_qwen2_audio_model()
     return {"status": status_message}
@@ -63,6 +143,7 @@ async def get_model_status():
     Provides detailed information about the Qwen2-Audio model's device placement
     and GPU memory usage if running on CUDA.
     """
+    from backend.services import llm_service
     # Access the global variables directly from the llm_service module
     status_message = check_model_devices(llm_service.qwen2_audio_model, llm_service.device)
     return {"status": status_message}
@@ -73,13 +154,14 @@ async def generate_invoice_from_audio_endpoint(
     transcript_text: Optional[str] = File(None, description="Optional pre-provided transcript of the audio.")
 ):
     """
-    Receives an audio file, uploads it to MinIO, uses the Qwen2-Audio model to extract invoice data,
+    Receives an audio file, uploads it to MinIO while the Qwen2-Audio model extracts invoice data from it,
     autofills missing details, generates a PDF invoice, uploads the PDF to MinIO,
     and returns the structured data along with the PDF's MinIO path.
 
     Returns:
-        JSONResponse: Contains the extracted InvoiceData and the MinIO object name for the PDF.
+        ORJSONResponse: Contains the extracted InvoiceData and the MinIO object name for the PDF.
     """
+    from backend.services import llm_service
     # Check the global variables directly from the llm_service module
     if llm_service.qwen2_audio_model is None or llm_service.qwen2_audio_processor is None:
         raise HTTPException(
@@ -92,29 +174,31 @@ async def generate_invoice_from_audio_endpoint(
     audio_object_name = f"audio-{uuid.uuid4()}{file_extension}"
 
     try:
-        # 1. Read audio content into BytesIO
+        # 1. Read the audio once; the same bytes feed both the MinIO upload and the LLM
         audio_content = await audio_file.read()
-        audio_bytesio = BytesIO(audio_content)
-
-        # 2. Upload audio to MinIO
-        minio_storage_service.upload_file(
-            bucket_name=MINIO_AUDIO_BUCKET,
-            object_name=audio_object_name,
-            data=audio_bytesio,
-            length=len(audio_content),
-            content_type=audio_file.content_type
-        )
-        print(f"Audio uploaded to MinIO: {MINIO_AUDIO_BUCKET}/{audio_object_name}")
 
-        # 3. Process audio with LLM to extract invoice data (LLM service will download from MinIO internally)
-        # Call the function from the llm_service module
-        invoice_data = await llm_service.extract_and_validate_invoice_data(audio_object_name, transcript_text)
+        # 2. Upload audio to MinIO and extract invoice data with the LLM concurrently.
+        #    MinIO calls are blocking HTTP requests, so the upload runs in a worker thread to keep the event loop free,
+        #    and the LLM works from the in-memory bytes instead of downloading the audio back from MinIO.
+        _, invoice_data = await _gather_or_cancel(
+            asyncio.to_thread(
+                get_minio().upload_file,
+                bucket_name=MINIO_AUDIO_BUCKET,
+                object_name=audio_object_name,
+                data=audio_content, # upload_file wraps the bytes without an up-front copy
+                length=len(audio_content),
+                content_type=audio_file.content_type
+            ),
+            # Call the function from the llm_service module
+            llm_service.extract_and_validate_invoice_data(audio_content, transcript_text)
+        )
+        logger.info("Audio uploaded to MinIO: %s/%s", MINIO_AUDIO_BUCKET, audio_object_name)
 
-        # 4. Generate PDF and upload to MinIO
-        pdf_object_name = generate_invoice_pdf(invoice_data)
-        print(f"PDF generated and uploaded to MinIO: {MINIO_PDF_BUCKET}/{pdf_object_name}")
+        # 3. Generate PDF and upload to MinIO, off the event loop
+        pdf_object_name = await generate_invoice_pdf_async(invoice_data)
+        logger.info("PDF generated and uploaded to MinIO: %s/%s", MINIO_PDF_BUCKET, pdf_object_name)
 
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "invoice_data": invoice_data.model_dump(),
             "audio_object_name": audio_object_name, # Return the MinIO path for the uploaded audio
             "pdf_object_name": pdf_object_name,     # Return the MinIO path for the generated PDF
@@ -128,38 +212,37 @@ async def generate_invoice_from_audio_endpoint(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Service error: {e}")
     except Exception as e:
         # Catch-all for unexpected errors
-        print(f"Unexpected error in generate_invoice_from_audio_endpoint: {e}")
+        logger.error("Unexpected error in generate_invoice_from_audio_endpoint: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An unexpected error occurred: {e}")
 
-@app.post("/generate_invoice_from_data/", response_model=dict, summary="Generate Invoice from Structured Data")
-async def generate_invoice_from_data_endpoint(invoice_data: InvoiceData):
+@app.post("/generate_invoice_from_data/", response_model=dict, summary="Generate Invoice from Structured Data", openapi_extra=_INVOICE_DATA_BODY_OPENAPI)
+async def generate_invoice_from_data_endpoint(invoice_data: InvoiceData = Depends(_invoice_data_body)):
     """
     Generates a PDF invoice directly from provided structured invoice data and uploads it to MinIO.
     This endpoint can be used if the frontend already has the parsed invoice details.
 
     Args:
-        invoice_data (InvoiceData): The structured invoice data.
+        invoice_data (InvoiceData): The structured invoice data, validated without computing totals (see _invoice_data_body).
 
     Returns:
-        JSONResponse: Contains the processed InvoiceData and the MinIO object name for the PDF.
+        ORJSONResponse: Contains the processed InvoiceData and the MinIO object name for the PDF.
     """
     try:
-        # Create a mutable copy to apply autofill without affecting the original request payload
-        invoice_data_processed = invoice_data.model_copy(deep=True)
+        # autofill_invoice_data works on its own copy, so the original request payload is left untouched
         from backend.core.utils import autofill_invoice_data
-        invoice_data_processed = autofill_invoice_data(invoice_data_processed)
+        invoice_data_processed = autofill_invoice_data(invoice_data)
 
-        # Generate PDF and upload to MinIO
-        pdf_object_name = generate_invoice_pdf(invoice_data_processed)
-        print(f"PDF generated and uploaded to MinIO: {MINIO_PDF_BUCKET}/{pdf_object_name}")
+        # Generate PDF and upload to MinIO, off the event loop
+        pdf_object_name = await generate_invoice_pdf_async(invoice_data_processed)
+        logger.info("PDF generated and uploaded to MinIO: %s/%s", MINIO_PDF_BUCKET, pdf_object_name)
 
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "invoice_data": invoice_data_processed.model_dump(),
             "pdf_object_name": pdf_object_name,
             "message": "Invoice PDF generated from provided data and stored in MinIO."
         })
     except Exception as e:
-        print(f"Error in generate_invoice_from_data_endpoint: {e}")
+        logger.error("Error in generate_invoice_from_data_endpoint: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error generating invoice from data: {e}")
 
 @app.get("/download_invoice/{object_name:path}", summary="Download Generated Invoice PDF from MinIO")
@@ -171,29 +254,41 @@ async def download_invoice(object_name: str):
         object_name (str): The full object name (e.g., 'invoice_client_INV-2025-XXX.pdf') of the PDF in the MinIO bucket.
 
     Returns:
-        FileResponse: The PDF file.
+        RedirectResponse | StreamingResponse: A redirect to a pre-signed MinIO URL for the PDF
+        when MINIO_PRESIGNED_DOWNLOADS is enabled, otherwise the PDF streamed through this API.
     """
     try:
-        # Check if the object exists in MinIO
-        if not minio_storage_service.object_exists(MINIO_PDF_BUCKET, object_name):
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Invoice PDF '{object_name}' not found in MinIO bucket '{MINIO_PDF_BUCKET}'.")
-
-        # Download the file from MinIO
-        pdf_data_bytesio = minio_storage_service.download_file(MINIO_PDF_BUCKET, object_name)
-        
         # Determine the filename for the client download
         filename_for_download = os.path.basename(object_name)
+        content_disposition = f"attachment; filename={filename_for_download}"
 
-        return FileResponse(
-            content=pdf_data_bytesio.getvalue(), # Get the content bytes from BytesIO
+        if MINIO_PRESIGNED_DOWNLOADS:
+            # Signing is local, so this existence check is the only MinIO round trip on this path
+            if not await asyncio.to_thread(get_minio().object_exists, MINIO_PDF_BUCKET, object_name):
+                raise FileNotFoundError(f"Invoice PDF '{object_name}' not found in MinIO bucket '{MINIO_PDF_BUCKET}'.")
+            # Let the client fetch the bytes directly from MinIO instead of proxying them through this worker
+            presigned_url = await asyncio.to_thread(
+                get_minio().presigned_download_url,
+                MINIO_PDF_BUCKET,
+                object_name,
+                response_headers={"response-content-type": "application/pdf", "response-content-disposition": content_disposition}
+            )
+            return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+        # Stream the file from MinIO in chunks rather than materializing it in memory; the single GET
+        # raises FileNotFoundError for a missing object, so no separate existence check is needed
+        # (the chunks themselves are read in Starlette's threadpool as the response is sent)
+        pdf_stream = await asyncio.to_thread(get_minio().stream_file, MINIO_PDF_BUCKET, object_name)
+
+        return StreamingResponse(
+            pdf_stream,
             media_type="application/pdf",
-            filename=filename_for_download,
-            headers={"Content-Disposition": f"attachment; filename={filename_for_download}"}
+            headers={"Content-Disposition": content_disposition}
         )
     except FileNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except Exception as e:
-        print(f"Error downloading invoice from MinIO: {e}")
+        logger.error("Error downloading invoice from MinIO: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred while downloading the PDF: {e}")
 
 @app.get("/get_audio/{object_name:path}", summary="Get Audio Input from MinIO")
@@ -205,34 +300,41 @@ async def get_audio(object_name: str):
         object_name (str): The full object name (e.g., 'audio-UUID.wav') of the audio in the MinIO bucket.
 
     Returns:
-        FileResponse: The audio file.
+        RedirectResponse | StreamingResponse: A redirect to a pre-signed MinIO URL for the audio
+        when MINIO_PRESIGNED_DOWNLOADS is enabled, otherwise the audio streamed through this API.
     """
     try:
-        # Check if the object exists in MinIO
-        if not minio_storage_service.object_exists(MINIO_AUDIO_BUCKET, object_name):
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Audio file '{object_name}' not found in MinIO bucket '{MINIO_AUDIO_BUCKET}'.")
-
-        # Download the file from MinIO
-        audio_data_bytesio = minio_storage_service.download_file(MINIO_AUDIO_BUCKET, object_name)
-        
         # Determine the filename for the client download
         filename_for_download = os.path.basename(object_name)
-        # Attempt to infer content type; fallback to octet-stream
-        content_type = "application/octet-stream"
-        if filename_for_download.lower().endswith(".wav"):
-            content_type = "audio/wav"
-        elif filename_for_download.lower().endswith(".mp3"):
-            content_type = "audio/mpeg" # or audio/mp3
-
-        return FileResponse(
-            content=audio_data_bytesio.getvalue(),
+        # Infer content type from the extension; fallback to octet-stream
+        extension = os.path.splitext(filename_for_download)[1].lower()
+        content_type = _AUDIO_CT.get(extension, "application/octet-stream")
+        content_disposition = f"inline; filename={filename_for_download}" # Use inline to play in browser
+
+        if MINIO_PRESIGNED_DOWNLOADS:
+            # Signing is local, so this existence check is the only MinIO round trip on this path
+            if not await asyncio.to_thread(get_minio().object_exists, MINIO_AUDIO_BUCKET, object_name):
+                raise FileNotFoundError(f"Audio file '{object_name}' not found in MinIO bucket '{MINIO_AUDIO_BUCKET}'.")
+            # Let the client fetch the bytes directly from MinIO instead of proxying them through this worker
+            presigned_url = await asyncio.to_thread(
+                get_minio().presigned_download_url,
+                MINIO_AUDIO_BUCKET,
+                object_name,
+                response_headers={"response-content-type": content_type, "response-content-disposition": content_disposition}
+            )
+            return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+        # Stream the file from MinIO in chunks (a missing object raises FileNotFoundError from the GET)
+        audio_stream = await asyncio.to_thread(get_minio().stream_file, MINIO_AUDIO_BUCKET, object_name)
+
+        return StreamingResponse(
+            audio_stream,
             media_type=content_type,
-            filename=filename_for_download,
-            headers={"Content-Disposition": f"inline; filename={filename_for_download}"} # Use inline to play in browser
+            headers={"Content-Disposition": content_disposition}
         )
     except FileNotFoundError as e:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
     except Exception as e:
-        print(f"Error getting audio from MinIO: {e}")
+        logger.error("Error getting audio from MinIO: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred while retrieving the audio: {e}")
 
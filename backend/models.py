@@ -4,6 +4,7 @@ from pydantic import BaseModel, Field, ValidationError # Ensure ValidationError
 from typing import List, Optional, Any
 import datetime
 
+
 class InvoiceItem(BaseModel):
     """
     Represents a single item in an invoice.
@@ -16,11 +17,58 @@ class InvoiceItem(BaseModel):
     def model_post_init(self, __context: Any) -> None:
         """
         Pydantic V2 post-initialization hook. Calculates total if not provided.
+        Skipped when validated with context={"defer_totals": True} (see InvoiceData).
         """
+        if __context and __context.get("defer_totals"):
+            return
         if self.total is None:
             self.total = round(self.quantity * self.unit_price, 2) # Round to 2 decimal places
 
 
+def _compute_totals(items: List[InvoiceItem]) -> float:
+    """
+    Computes all item totals (quantity * unit_price, missing values count as 0) in a single
+    pass and returns the subtotal. Used on validation; autofill_invoice_data accumulates the same
+    per-item _item_total values in its own item loop, so both paths bill the same amounts.
+    Each total is rounded with Python's round(x, 2), which rounds the exact float value;
+    a NumPy rint(x * 100) / 100 shortcut would shift some cents (e.g. 0.5 * 25.05).
+
+    Args:
+        items (List[InvoiceItem]): The invoice items; their `total` fields are updated in place.
+
+    Returns:
+        float: Sum of all item totals, rounded to 2 decimal places.
+    """
+    subtotal = 0.0
+    for item in items:
+        total = _item_total(item)
+        object.__setattr__(item, "total", total) # Trusted value, bypass BaseModel.__setattr__
+        subtotal += total
+    return round(subtotal, 2)
+
+
+def _item_total(item: InvoiceItem) -> float:
+    """Rounds quantity * unit_price to cents (missing values count as 0), see _compute_totals."""
+    return round((item.quantity or 0) * (item.unit_price or 0), 2)
+
+
+def _finalize_totals(invoice: "InvoiceData", subtotal: Optional[float] = None) -> None:
+    """
+    Calculates subtotal, tax_amount and grand_total on an invoice in place.
+
+    Args:
+        invoice (InvoiceData): The invoice to update.
+        subtotal (Optional[float]): A rounded subtotal the caller already accumulated while setting
+                                    the item totals. If None, item totals and the subtotal are
+                                    calculated via _compute_totals.
+    """
+    invoice.subtotal = subtotal if subtotal is not None else _compute_totals(invoice.items)
+    # Ensure tax_rate is not None before multiplication
+    effective_tax_rate = invoice.tax_rate if invoice.tax_rate is not None else 0.0
+    invoice.tax_amount = round(invoice.subtotal * effective_tax_rate, 2)
+    invoice.grand_total = round(invoice.subtotal + invoice.tax_amount, 2)
+
+
 class InvoiceData(BaseModel):
     """
     Represents the complete structured data for an invoice.
@@ -42,14 +90,11 @@ class InvoiceData(BaseModel):
         Pydantic V2 post-initialization hook. Calculates subtotal, tax_amount, and grand_total.
         These are primarily for consistency and display, the autofill_invoice_data
         utility will ensure robust calculation.
+
+        Callers that autofill straight after validation can pass
+        context={"defer_totals": True} to model_validate to skip this pass,
+        so the totals are only computed once, by autofill_invoice_data.
         """
-        # Ensure item totals are calculated before summing for subtotal
-        for item in self.items:
-            if item.total is None: # This should ideally be handled by InvoiceItem's post_init
-                item.total = round(item.quantity * item.unit_price, 2)
-
-        self.subtotal = round(sum(item.total for item in self.items if item.total is not None), 2) if self.items else 0.0
-        # Ensure tax_rate is not None before multiplication
-        effective_tax_rate = self.tax_rate if self.tax_rate is not None else 0.0
-        self.tax_amount = round(self.subtotal * effective_tax_rate, 2)
-        self.grand_total = round(self.subtotal + self.tax_amount, 2)
+        if __context and __context.get("defer_totals"):
+            return
+        _finalize_totals(self)
@@ -1,43 +1,220 @@
 # backend/services/llm_service.py
 
+import asyncio
 import torch
-from transformers import Qwen2AudioForConditionalGeneration, AutoProcessor
+import torch.nn.functional as F
+from transformers import Qwen2AudioForConditionalGeneration, AutoProcessor, BitsAndBytesConfig, StoppingCriteria, StoppingCriteriaList
 import librosa
-import re
-import json
-import os
-from typing import Dict, Any, Optional
-from backend.config import QWEN2_AUDIO_MODEL_NAME, MINIO_AUDIO_BUCKET
-from backend.models import InvoiceData, InvoiceItem
-from backend.core.utils import clear_gpu_memory, autofill_invoice_data
-from backend.services.storage_service import minio_storage_service # Import the MinIO service
+import numpy as np
+import soundfile
+import soxr
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, Any, List, Optional, BinaryIO, Tuple, Union
+from backend.config import QWEN2_AUDIO_MODEL_NAME, CUDA_MEMORY_FRACTION, TORCH_COMPILE, LLM_MAX_BATCH_SIZE, LLM_MAX_WAIT_MS
+from backend.models import InvoiceData, InvoiceItem, ValidationError
+from backend.core.utils import force_release_gpu, autofill_invoice_data
+
+logger = logging.getLogger(__name__)
 
 # Global variables to hold model instances for efficiency
 qwen2_audio_processor = None
 qwen2_audio_model = None
 device = "cuda" if torch.cuda.is_available() else "cpu"
+use_bf16 = False # Set at load time: True on Ampere+ GPUs, where weights and autocast use bfloat16
+
+# Define the desired JSON schema for the LLM. Updated to match Pydantic model closely.
+INVOICE_JSON_SCHEMA = """
+    {
+      "client_name": "string (e.g., John Doe, ACME Corp)",
+      "client_address": "string (e.g., 123 Main St, Anytown, CA)",
+      "invoice_number": "string (optional, e.g., INV-2025-001)",
+      "invoice_date": "YYYY-MM-DD (optional, defaults to today if not specified)",
+      "due_date": "YYYY-MM-DD (optional, defaults to invoice_date + 30 days if not specified)",
+      "items": [
+        {
+          "description": "string (e.g., Laptop, Consulting Services)",
+          "quantity": "float (e.g., 1.0, 2.5)",
+          "unit_price": "float (e.g., 1200.00, 75.50)"
+        }
+      ],
+      "notes": "string (optional, any additional notes)"
+    }
+    """
+
+# Fixed part of the prompt; it lives in the system turn so it can be tokenized once at load time.
+SYSTEM_PROMPT = (
+    "You are an AI assistant that extracts structured invoice data from spoken requests. "
+    "Your output MUST be a valid JSON object matching the provided schema. Do not include any other text or explanation outside the JSON. "
+    "Extract all available details, and use best guesses for missing information (like current date for invoice_date). "
+    "Ensure item totals are calculated by quantity * unit_price. "
+    "If no explicit invoice or due date, use today's date and 30 days from today respectively. "
+    f"If a field is not mentioned, omit it or set it to null. Here's the schema: {INVOICE_JSON_SCHEMA}"
+)
+USER_PROMPT = "Here is the invoice request. Please extract the details into a JSON object.\n\nInvoice request: "
+
+# Prompt template cache, filled by _cache_prompt_template() once the processor is loaded
+_PROMPT_TEXT_MARKER = "<<invoice_request_text>>" # Stands in for the per-request transcript in the rendered template
+_prompt_prefix_ids: Optional[torch.Tensor] = None # Token ids of the fixed system turn, shape [1, prefix_len]
+_prompt_suffix_template: Optional[str] = None # Rendered user + assistant turns containing _PROMPT_TEXT_MARKER
+
+# Upper bound on generated tokens; invoice JSON is typically well under 400 tokens
+MAX_NEW_TOKENS = 512
+
+# Micro-batching state, created lazily on the running event loop by _ensure_batch_worker()
+_batch_queue: Optional[asyncio.Queue] = None
+_batch_worker: Optional[asyncio.Task] = None
+# Every generate() call runs on this one thread, one batch at a time, on the default CUDA stream.
+# A single model instance is not safe to drive from several threads/streams at once.
+_generate_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qwen2-generate")
+
+@dataclass
+class _GenerationRequest:
+    """A single request's model inputs waiting in the micro-batching queue, with the future for its output."""
+    inputs: Dict[str, torch.Tensor]
+    future: asyncio.Future
+
+def _supports_bf16() -> bool:
+    """Returns True on Ampere (compute capability 8.0) or newer GPUs, which have native bfloat16 support."""
+    return device == "cuda" and torch.cuda.get_device_capability() >= (8, 0)
+
+def _build_quantization_config() -> BitsAndBytesConfig:
+    """
+    Builds the 4-bit NF4 quantization config used on GPU.
+    Weights stay 4-bit during inference and are dequantized per matmul in bfloat16
+    on Ampere+ (float16 on older GPUs).
+
+    Returns:
+        BitsAndBytesConfig: The config.
+
+    Raises:
+        RuntimeError: If bitsandbytes is not installed. Loading the unquantized 7B model instead
+                      (~15 GB in 16-bit) would run out of memory on the GPUs this path targets.
+    """
+    try:
+        import bitsandbytes # noqa: F401 - only checking that the quantization backend is available
+    except ImportError as e:
+        raise RuntimeError("bitsandbytes is required for 4-bit GPU loading; install it with `pip install bitsandbytes`.") from e
+    return BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_compute_dtype=torch.bfloat16 if use_bf16 else torch.float16,
+        bnb_4bit_use_double_quant=True
+    )
+
+class _BraceScanner:
+    """
+    Incremental one-pass scanner that locates the first top-level JSON object in a text stream.
+    Tracks brace depth plus string/escape state, so braces inside JSON strings are ignored.
+    Shared by the generation stopping criterion (fed token by token) and _find_json (fed once).
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start: Optional[int] = None # Offset of the object's opening brace in all text fed so far
+        self.end: Optional[int] = None # Offset just past its closing brace, once the object is complete
+        self._offset = 0 # Number of characters fed so far
+
+    def feed(self, text: str) -> bool:
+        """
+        Scans the next chunk of text.
+
+        Returns:
+            bool: True once the first top-level object has been closed.
+        """
+        if self.end is not None:
+            return True
+        depth, in_string, escaped = self.depth, self.in_string, self.escaped
+        for index, char in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                # Strings only count once the object has started; quotes in leading prose are ignored
+                in_string = depth > 0
+            elif char == "{":
+                if depth == 0:
+                    self.start = self._offset + index
+                depth += 1
+            elif char == "}" and depth > 0:
+                depth -= 1
+                if depth == 0:
+                    self.end = self._offset + index + 1
+                    break
+        self.depth, self.in_string, self.escaped = depth, in_string, escaped
+        self._offset += len(text)
+        return self.end is not None
+
+def _find_json(text: str) -> Optional[str]:
+    """Returns the first balanced top-level {...} object in text, or None if there is none."""
+    scanner = _BraceScanner()
+    return text[scanner.start:scanner.end] if scanner.feed(text) else None
+
+class BraceBalance(StoppingCriteria):
+    """
+    Stops generation as soon as the first top-level JSON object in the output is closed.
+    Newly generated tokens are decoded one at a time and fed through a _BraceScanner.
+    Each row of the batch is tracked separately.
+    """
+    def __init__(self, tokenizer, prompt_len: int):
+        """
+        Args:
+            tokenizer: The tokenizer used to decode generated token ids.
+            prompt_len (int): Length of the prompt in input_ids; only tokens after it are scanned.
+        """
+        self.tokenizer = tokenizer
+        self._scanned = prompt_len # Number of positions already fed through the scanners
+        self._scanners = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if not self._scanners:
+            self._scanners = [_BraceScanner() for _ in range(input_ids.shape[0])]
+
+        new_ids = input_ids[:, self._scanned:].tolist()
+        self._scanned = input_ids.shape[1]
+        for scanner, token_ids in zip(self._scanners, new_ids):
+            for token_id in token_ids:
+                if scanner.feed(self.tokenizer.decode(token_id)):
+                    break
+        return torch.tensor([scanner.end is not None for scanner in self._scanners], dtype=torch.bool, device=input_ids.device)
 
 def load_qwen2_audio_model() -> str:
     """
     Loads the Qwen2-Audio model and processor.
-    Uses 8-bit quantization for GPU to reduce VRAM usage.
+    Uses 4-bit NF4 quantization for GPU to reduce VRAM usage.
     """
-    global qwen2_audio_processor, qwen2_audio_model, device
+    global qwen2_audio_processor, qwen2_audio_model, device, use_bf16
 
     if qwen2_audio_model is None or qwen2_audio_processor is None:
         try:
-            print(f"Loading Qwen2-Audio model from {QWEN2_AUDIO_MODEL_NAME} for device: {device}")
+            logger.info("Loading Qwen2-Audio model from %s for device: %s", QWEN2_AUDIO_MODEL_NAME, device)
             qwen2_audio_processor = AutoProcessor.from_pretrained(QWEN2_AUDIO_MODEL_NAME, trust_remote_code=True)
 
             if device == "cuda":
+                # Cap the caching allocator up-front so it can keep freed blocks pooled
+                # instead of competing with other processes for the remaining VRAM.
+                for device_index in range(torch.cuda.device_count()):
+                    torch.cuda.set_per_process_memory_fraction(CUDA_MEMORY_FRACTION, device_index)
+                # bfloat16 keeps fp32's exponent range, avoiding fp16 overflow (NaN outputs) on GPUs that support it
+                use_bf16 = _supports_bf16()
+                gpu_dtype = torch.bfloat16 if use_bf16 else torch.float16
+                quantization_config = _build_quantization_config()
+                logger.info("Attempting to load model with 4-bit NF4 quantization.")
                 qwen2_audio_model = Qwen2AudioForConditionalGeneration.from_pretrained(
                     QWEN2_AUDIO_MODEL_NAME,
-                    load_in_8bit=True,
+                    quantization_config=quantization_config,
                     device_map="auto",
-                    torch_dtype=torch.float16,
+                    torch_dtype=gpu_dtype,
                     trust_remote_code=True
                 )
-                print("Attempting to load model with 8-bit quantization.")
             else:
                 qwen2_audio_model = Qwen2AudioForConditionalGeneration.from_pretrained(
                     QWEN2_AUDIO_MODEL_NAME,
@@ -45,78 +222,302 @@ def load_qwen2_audio_model() -> str:
                     torch_dtype=torch.float32,
                     trust_remote_code=True
                 )
-                print("Loading model for CPU in float32.")
+                logger.info("Loading model for CPU in float32.")
 
             qwen2_audio_model.eval()
+            # Set pad_token_id explicitly so generate() does not warn and fall back to eos on every call
+            generation_config = qwen2_audio_model.generation_config
+            if generation_config.pad_token_id is None:
+                tokenizer = qwen2_audio_processor.tokenizer
+                generation_config.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+            _cache_prompt_template()
+            compiled = device == "cuda" and TORCH_COMPILE and hasattr(torch, "compile") and _compile_model()
+            if not compiled: # A successful compile has already warmed the model up
+                try:
+                    _warm_up_model()
+                except Exception as e:
+                    logger.warning("Model warm-up failed, the first request will pay the one-time setup cost: %s", e)
             status_message = f"Qwen2-Audio model loaded on {device} successfully!"
-            print(status_message)
+            logger.info(status_message)
             return status_message
         except Exception as e:
             error_message = f"Error loading Qwen2-Audio model: {e}"
-            print(error_message)
+            logger.error(error_message)
             qwen2_audio_processor = None
             qwen2_audio_model = None
-            clear_gpu_memory()
+            use_bf16 = False
+            _reset_prompt_template()
+            force_release_gpu() # Return any partially loaded weights to the driver
             return f"Failed to load Qwen2-Audio model: {e}"
     else:
         status_message = "Qwen2-Audio model already loaded."
-        print(status_message)
+        logger.info(status_message)
         return status_message
 
-def create_qwen_invoice_prompt(audio_data_path: str, prompt_text: str = "") -> Dict:
+def _warm_up_model(max_new_tokens: int = 1) -> None:
+    """
+    Runs one second of silence through the processor and generate() once, so one-time costs
+    (the feature extractor's mel filterbank, CUDA kernel selection for the quantized weights,
+    compiled graphs) are paid at load time instead of by the first request.
+
+    generate() runs on _generate_executor, the same thread that serves real requests, so any
+    per-thread state it sets up (e.g. compiled-graph caches) is the one later requests use.
+
+    Args:
+        max_new_tokens (int): Tokens to generate; more than 1 also exercises the decode steps.
+    """
+    sampling_rate = qwen2_audio_processor.feature_extractor.sampling_rate
+    warmup_inputs = _prepare_model_inputs(np.zeros(sampling_rate, dtype=np.float32), "warm-up")
+
+    def generate_warmup():
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=use_bf16):
+            qwen2_audio_model.generate(**warmup_inputs, max_new_tokens=max_new_tokens, do_sample=False, num_beams=1)
+
+    _generate_executor.submit(generate_warmup).result()
+    logger.info("Qwen2-Audio warm-up finished.")
+
+def _compile_model() -> bool:
+    """
+    Compiles the model's forward pass with torch.compile and warms it up once.
+    generate() keeps running in eager Python and calls the compiled forward for each decoding step.
+
+    Uses the default mode (no CUDA graphs): prompt and KV-cache lengths differ per request and batch,
+    and reduce-overhead would record a new CUDA graph for every distinct length. Shapes are marked
+    dynamic, so the warm-up compiles the general graphs; a few shape-specialization recompiles
+    (e.g. the first batch with more than one row) can still happen on early requests.
+    Falls back to the eager forward if compilation or the warm-up fails.
+
+    Returns:
+        bool: True if the compiled forward is in use (and warmed up).
+    """
+    eager_forward = qwen2_audio_model.forward
+    try:
+        logger.info("Compiling Qwen2-Audio forward pass with torch.compile (mode=default, dynamic shapes).")
+        qwen2_audio_model.forward = torch.compile(eager_forward, mode="default", fullgraph=False, dynamic=True)
+        # A short generation exercises both the prefill and the decode graphs
+        _warm_up_model(max_new_tokens=10)
+        return True
+    except Exception as e:
+        logger.warning("torch.compile failed, using the eager model instead: %s", e)
+        qwen2_audio_model.forward = eager_forward
+        return False
+
+def _cache_prompt_template() -> None:
+    """
+    Renders the chat template once and pre-tokenizes its fixed system turn (instructions + JSON schema),
+    so each request only has to tokenize the short user turn carrying the audio and transcript.
+    """
+    global _prompt_prefix_ids, _prompt_suffix_template
+
+    conversation = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "audio", "audio_url": "invoice-request"}, # Rendered as the audio placeholder tokens
+            {"type": "text", "text": USER_PROMPT + _PROMPT_TEXT_MARKER},
+        ]},
+    ]
+    rendered_prompt = qwen2_audio_processor.apply_chat_template(conversation, add_generation_prompt=True, tokenize=False)
+    # Split right before the user turn. The boundary is a special token, so tokenizing the two halves
+    # separately yields exactly the same ids as tokenizing the whole prompt.
+    split_at = rendered_prompt.index("<|im_start|>user")
+    _prompt_prefix_ids = qwen2_audio_processor.tokenizer(
+        rendered_prompt[:split_at], return_tensors="pt", add_special_tokens=False
+    ).input_ids
+    _prompt_suffix_template = rendered_prompt[split_at:]
+
+def _reset_prompt_template() -> None:
+    """Drops the cached prompt template, e.g. after a failed model load."""
+    global _prompt_prefix_ids, _prompt_suffix_template
+    _prompt_prefix_ids = None
+    _prompt_suffix_template = None
+
+def create_qwen_invoice_prompt(audio_source: Union[str, BinaryIO], prompt_text: str = "") -> Dict:
     """
     Creates the prompt for the Qwen2-Audio LLM, instructing it to extract structured invoice data.
     The output format is explicitly requested as JSON.
 
+    The fixed system turn is taken pre-tokenized from the cache built at load time; only the
+    user turn (audio placeholder + transcript) is run through the processor here.
+
     Args:
-        audio_data_path (str): The local file path to the audio data.
-                               This function assumes the audio is already downloaded locally.
+        audio_source (Union[str, BinaryIO]): A local file path or an in-memory file-like object
+                                             (e.g. BytesIO) holding the encoded audio.
         prompt_text (str): Optional pre-provided transcript or additional prompt text.
 
     Returns:
         Dict: Inputs prepared for the Qwen2-Audio model.
     """
-    if qwen2_audio_processor is None:
+    if qwen2_audio_processor is None or _prompt_prefix_ids is None or _prompt_suffix_template is None:
         raise RuntimeError("Qwen2-Audio processor is not loaded. Please load the model first.")
 
+    sampling_rate = qwen2_audio_processor.feature_extractor.sampling_rate
     try:
-        # librosa expects a file path or file-like object. We are passing a local path.
-        audio, _ = librosa.load(audio_data_path, sr=qwen2_audio_processor.feature_extractor.sampling_rate)
+        audio = _load_audio(audio_source, sampling_rate)
     except Exception as e:
-        raise ValueError(f"Error loading audio file from {audio_data_path}: {e}")
+        raise ValueError(f"Error loading audio data: {e}")
 
-    # Define the desired JSON schema for the LLM. Updated to match Pydantic model closely.
-    json_schema = """
-    {
-      "client_name": "string (e.g., John Doe, ACME Corp)",
-      "client_address": "string (e.g., 123 Main St, Anytown, CA)",
-      "invoice_number": "string (optional, e.g., INV-2025-001)",
-      "invoice_date": "YYYY-MM-DD (optional, defaults to today if not specified)",
-      "due_date": "YYYY-MM-DD (optional, defaults to invoice_date + 30 days if not specified)",
-      "items": [
-        {
-          "description": "string (e.g., Laptop, Consulting Services)",
-          "quantity": "float (e.g., 1.0, 2.5)",
-          "unit_price": "float (e.g., 1200.00, 75.50)"
-        }
-      ],
-      "notes": "string (optional, any additional notes)"
-    }
+    return _prepare_model_inputs(audio, prompt_text)
+
+def _load_audio(source: Union[str, BinaryIO], target_sr: int) -> np.ndarray:
     """
+    Decodes audio to a mono float32 array at target_sr.
+    Uses libsndfile (soundfile) and the C soxr resampler, skipping resampling when the
+    source is already at target_sr. Formats libsndfile can't decode (e.g. webm/opus, m4a/aac)
+    go through librosa, which only tries its audioread backend (needs ffmpeg) for file paths,
+    so file-like sources are spilled to a temporary file first.
 
-    # Craft the prompt for the LLM, instructing it to act as an invoice data extractor.
-    messages = [
-        {"role": "system", "content": "You are an AI assistant that extracts structured invoice data from spoken requests. Your output MUST be a valid JSON object matching the provided schema. Do not include any other text or explanation outside the JSON. Extract all available details, and use best guesses for missing information (like current date for invoice_date)."},
-        {"role": "user", "content": f"Here is the invoice request. Please extract the details into a JSON object. Ensure item totals are calculated by quantity * unit_price. If no explicit invoice or due date, use today's date and 30 days from today respectively. If a field is not mentioned, omit it or set it to null. Here's the schema: {json_schema}\n\nInvoice request: {prompt_text}"}
-    ]
+    Args:
+        source (Union[str, BinaryIO]): A file path or a readable binary file-like object.
+        target_sr (int): The sampling rate expected by the feature extractor.
+
+    Returns:
+        np.ndarray: The mono waveform.
+    """
+    try:
+        audio, source_sr = soundfile.read(source, dtype="float32", always_2d=False)
+    except Exception as e:
+        logger.debug("soundfile could not decode audio, falling back to librosa: %s", e)
+        if isinstance(source, str):
+            audio, _ = librosa.load(source, sr=target_sr)
+            return audio
+        source.seek(0) # soundfile may have consumed part of the stream
+        with tempfile.NamedTemporaryFile() as spill:
+            spill.write(source.read())
+            spill.flush()
+            audio, _ = librosa.load(spill.name, sr=target_sr)
+        return audio
+    if audio.ndim > 1:
+        audio = audio.mean(axis=-1) # Mix down to mono before resampling, so only one channel is resampled
+    if source_sr != target_sr:
+        audio = soxr.resample(audio, source_sr, target_sr, quality="HQ")
+    return audio
+
+def _prepare_model_inputs(audio: np.ndarray, prompt_text: str = "") -> Dict:
+    """
+    Builds the model inputs for decoded audio (at the feature extractor's sampling rate)
+    and moves them to the model's device.
+    """
+    sampling_rate = qwen2_audio_processor.feature_extractor.sampling_rate
+
+    # The processor expands the audio placeholder in the user turn to match the audio length
+    # and extracts the audio features; the cached system-turn ids are prepended afterwards.
+    user_turn = _prompt_suffix_template.replace(_PROMPT_TEXT_MARKER, prompt_text or "")
+    inputs = dict(qwen2_audio_processor(text=user_turn, audio=audio, sampling_rate=sampling_rate, return_tensors="pt"))
+    inputs["input_ids"] = torch.cat([_prompt_prefix_ids, inputs["input_ids"]], dim=1)
+    inputs["attention_mask"] = torch.cat([torch.ones_like(_prompt_prefix_ids), inputs["attention_mask"]], dim=1)
 
-    # Qwen2-Audio expects a single audio input along with a list of messages
-    # The `audio` parameter is specifically for the audio input, not part of the messages content.
-    inputs = qwen2_audio_processor(audio=audio, text=messages, return_tensors="pt")
-    inputs = {k: v.to(device) for k, v in inputs.items()} # Move inputs to correct device
+    # Move inputs to correct device; from pinned host memory the copies can run asynchronously
+    if device == "cuda":
+        inputs = {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+    else:
+        inputs = {k: v.to(device) for k, v in inputs.items()}
 
     return inputs
 
+def _collate_inputs(inputs_list: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+    """
+    Pads per-request model inputs to a common length and stacks them into one batch.
+    input_ids/attention_mask are left-padded so every prompt ends right where generation starts;
+    audio features and their mask are right-padded with zeros.
+    """
+    if len(inputs_list) == 1:
+        return inputs_list[0]
+    pad_token_id = qwen2_audio_model.generation_config.pad_token_id
+    batch = {}
+    for key in inputs_list[0]:
+        tensors = [inputs[key] for inputs in inputs_list]
+        max_len = max(t.shape[-1] for t in tensors)
+        if key in ("input_ids", "attention_mask"):
+            pad_value = pad_token_id if key == "input_ids" else 0
+            tensors = [F.pad(t, (max_len - t.shape[-1], 0), value=pad_value) for t in tensors]
+        else:
+            tensors = [F.pad(t, (0, max_len - t.shape[-1]), value=0) for t in tensors]
+        batch[key] = torch.cat(tensors, dim=0)
+    return batch
+
+def _generate_batch(inputs_list: List[Dict[str, torch.Tensor]]) -> Tuple[torch.Tensor, int]:
+    """
+    Runs a single generate() call over a batch of requests. Blocking; only called on _generate_executor.
+
+    Returns:
+        Tuple[torch.Tensor, int]: The generated ids [batch, seq] and the (padded) prompt length.
+    """
+    batch_inputs = _collate_inputs(inputs_list)
+    prompt_len = batch_inputs["input_ids"].shape[1]
+    # Greedy decoding; each row stops once its JSON object is closed
+    stopping_criteria = StoppingCriteriaList([BraceBalance(qwen2_audio_processor.tokenizer, prompt_len)])
+    # inference_mode also skips autograd view/version-counter tracking; outputs are only decoded to text
+    # On Ampere+ GPUs the dense (non-quantized) ops additionally run under bfloat16 autocast
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.bfloat16, enabled=use_bf16):
+        generated_ids = qwen2_audio_model.generate(
+            **batch_inputs,
+            max_new_tokens=MAX_NEW_TOKENS,
+            stopping_criteria=stopping_criteria,
+            use_cache=True,
+            do_sample=False,
+            num_beams=1
+        )
+    return generated_ids, prompt_len
+
+async def _batch_worker_loop() -> None:
+    """
+    Collects concurrent generation requests into batches of up to LLM_MAX_BATCH_SIZE,
+    waiting at most LLM_MAX_WAIT_MS after the first one, and runs each batch through generate() once.
+    Batches run one after another; requests arriving meanwhile are collected into the next batch.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + LLM_MAX_WAIT_MS / 1000
+        while len(batch) < LLM_MAX_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Requests cancelled while queued (e.g. their sibling MinIO upload failed) don't take a batch slot
+        batch = [request for request in batch if not request.future.done()]
+        if not batch:
+            continue
+        if len(batch) > 1:
+            logger.debug("Running generate() on a batch of %d requests", len(batch))
+        try:
+            generated_ids, prompt_len = await loop.run_in_executor(_generate_executor, _generate_batch, [request.inputs for request in batch])
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            continue
+        for row, request in enumerate(batch):
+            if not request.future.done(): # The caller may have been cancelled meanwhile
+                request.future.set_result((generated_ids[row:row + 1], prompt_len))
+
+def _ensure_batch_worker() -> None:
+    """Starts the micro-batching worker on the running event loop if it isn't running yet."""
+    global _batch_queue, _batch_worker
+    if _batch_worker is None or _batch_worker.done():
+        _batch_queue = asyncio.Queue()
+        _batch_worker = asyncio.get_running_loop().create_task(_batch_worker_loop())
+
+async def generate_batched(inputs: Dict[str, torch.Tensor]) -> Tuple[torch.Tensor, int]:
+    """
+    Queues a request's model inputs for the next micro-batch and waits for its output.
+
+    Args:
+        inputs (Dict[str, torch.Tensor]): Inputs from create_qwen_invoice_prompt (batch size 1).
+
+    Returns:
+        Tuple[torch.Tensor, int]: This request's generated ids [1, seq] and the prompt length
+                                  to skip when decoding (see process_llm_output).
+    """
+    _ensure_batch_worker()
+    future = asyncio.get_running_loop().create_future()
+    await _batch_queue.put(_GenerationRequest(inputs=inputs, future=future))
+    return await future
+
 def process_llm_output(output_ids: torch.Tensor, original_input_len: int) -> str:
     """Decodes the LLM output and extracts the JSON string."""
     if qwen2_audio_processor is None:
@@ -127,13 +528,14 @@ def process_llm_output(output_ids: torch.Tensor, original_input_len: int) -> str
     generated_text = qwen2_audio_processor.decode(output_ids[0, original_input_len:], skip_special_tokens=True)
     return generated_text
 
-async def extract_and_validate_invoice_data(audio_object_name: str, transcript_text: str = "") -> InvoiceData:
+async def extract_and_validate_invoice_data(audio_bytes: bytes, transcript_text: str = "") -> InvoiceData:
     """
-    Downloads an audio file from MinIO, processes it with the LLM to extract invoice data,
+    Processes audio with the LLM to extract invoice data,
     validates it with Pydantic, and autofills missing information.
 
     Args:
-        audio_object_name (str): The object name of the audio file in the MinIO audio bucket.
+        audio_bytes (bytes): The raw content of the audio file. The caller is responsible
+                             for persisting it (e.g. uploading it to MinIO) if needed.
         transcript_text (str): Optional pre-provided transcript of the audio.
 
     Returns:
@@ -142,58 +544,37 @@ async def extract_and_validate_invoice_data(audio_object_name: str, transcript_t
     if qwen2_audio_model is None or qwen2_audio_processor is None:
         raise RuntimeError("Qwen2-Audio model and/or processor not loaded. Call load_qwen2_audio_model() first.")
 
-    temp_audio_file_path = f"/tmp/{audio_object_name.split('/')[-1]}" # Use /tmp for temporary storage
-
-    try:
-        # 1. Download audio from MinIO to a temporary local file
-        audio_data_bytesio = minio_storage_service.download_file(MINIO_AUDIO_BUCKET, audio_object_name)
-        with open(temp_audio_file_path, "wb") as f:
-            f.write(audio_data_bytesio.read())
-        print(f"Downloaded audio from MinIO to temporary path: {temp_audio_file_path}")
-
-        # 2. Create prompt and get inputs for the LLM using the local file
-        llm_inputs = create_qwen_invoice_prompt(temp_audio_file_path, transcript_text)
-        original_input_len = llm_inputs['input_ids'].shape[1]
+    # 1-2. Decode the audio straight from memory and create the prompt inputs for the LLM.
+    # Runs in a worker thread so feature extraction overlaps with the batch currently generating.
+    llm_inputs = await asyncio.to_thread(create_qwen_invoice_prompt, BytesIO(audio_bytes), transcript_text)
 
-        # 3. Generate response from LLM
-        with torch.no_grad():
-            generated_ids = qwen2_audio_model.generate(**llm_inputs, max_new_tokens=2048)
+    # 3. Generate response from LLM, batched with other concurrent requests
+    generated_ids, original_input_len = await generate_batched(llm_inputs)
 
-        # 4. Process LLM output
-        llm_raw_output = process_llm_output(generated_ids, original_input_len)
-        print(f"LLM Raw Output:\n{llm_raw_output}")
+    # 4. Process LLM output
+    llm_raw_output = process_llm_output(generated_ids, original_input_len)
+    logger.debug("LLM Raw Output:\n%s", llm_raw_output)
 
-        # 5. Extract JSON part using regex
-        json_match = re.search(r"```json\s*(\{.*\})\s*```", llm_raw_output, re.DOTALL)
-        if not json_match:
-            # Fallback: try to find the JSON directly if it's not wrapped in markdown
-            json_match = re.search(r"(\{.*\})", llm_raw_output, re.DOTALL)
+    # 5. Extract the JSON object (markdown-fenced or bare) with a single linear scan
+    json_str = _find_json(llm_raw_output)
+    if json_str is None:
+        raise ValueError("Could not extract a valid JSON object from LLM output.")
 
-        if not json_match:
-            raise ValueError("Could not extract a valid JSON object from LLM output.")
-
-        json_str = json_match.group(1)
-
-        try:
-            extracted_data = json.loads(json_str)
-            print(f"Extracted JSON Data: {extracted_data}")
-            # Validate and convert to Pydantic model
-            invoice_data = InvoiceData.model_validate(extracted_data)
-            print(f"Validated Invoice Data (before autofill): {invoice_data.model_dump_json(indent=2)}")
-            # Autofill missing details using the comprehensive function from utils
-            invoice_data = autofill_invoice_data(invoice_data)
-            print(f"Final Invoice Data (after autofill): {invoice_data.model_dump_json(indent=2)}")
-            return invoice_data
-        except json.JSONDecodeError as e:
+    try:
+        logger.debug("Extracted JSON Data: %s", json_str)
+        # Parse and validate in one step (no intermediate dict); totals are deferred to autofill below
+        invoice_data = InvoiceData.model_validate_json(json_str, context={"defer_totals": True})
+        if logger.isEnabledFor(logging.DEBUG): # Avoid serializing the model unless it will be logged
+            logger.debug("Validated Invoice Data (before autofill): %s", invoice_data.model_dump_json(indent=2))
+        # Autofill missing details using the comprehensive function from utils
+        invoice_data = autofill_invoice_data(invoice_data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Final Invoice Data (after autofill): %s", invoice_data.model_dump_json(indent=2))
+        return invoice_data
+    except ValidationError as e:
+        # Malformed JSON is reported by model_validate_json as a "json_invalid" validation error
+        if any(error["type"] == "json_invalid" for error in e.errors()):
             raise ValueError(f"Failed to decode JSON from LLM output: {e}. Raw output: {json_str}")
-        except Exception as e: # Catch Pydantic ValidationError here and re-raise as ValueError
-            if "validation" in str(e).lower() and "model" in str(e).lower(): # Simple check for Pydantic validation error
-                raise ValueError(f"Pydantic validation failed for extracted data: {e}. Data: {json_str}")
-            else:
-                raise RuntimeError(f"An unexpected error occurred during data extraction or validation: {e}")
-    finally:
-        # Clean up the temporary audio file
-        if os.path.exists(temp_audio_file_path):
-            os.remove(temp_audio_file_path)
-            print(f"Cleaned up temporary audio file: {temp_audio_file_path}")
-
+        raise ValueError(f"Pydantic validation failed for extracted data: {e}. Data: {json_str}")
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred during data extraction or validation: {e}")
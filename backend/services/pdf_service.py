@@ -6,13 +6,83 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 # from reportlab.pdfgen import canvas # Not directly used with SimpleDocTemplate for main content
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from datetime import datetime
+from typing import List, Optional, Tuple
 
-from backend.models import InvoiceData
+from backend.models import InvoiceData, InvoiceItem
 from backend.config import MINIO_PDF_BUCKET
-from backend.services.storage_service import minio_storage_service # Import the MinIO service
+from backend.services.storage_service import get_minio # Accessor for the shared MinIO service
+
+logger = logging.getLogger(__name__)
+
+# Styles and document settings are built once at import; getSampleStyleSheet() rebuilds the whole sheet per call.
+# They are only read during doc.build, so sharing them between PDFs is safe.
+_STYLES = getSampleStyleSheet()
+_NORMAL = _STYLES['Normal']
+_H1 = _STYLES['h1']
+_H3 = _STYLES['h3']
+_ITALIC = _STYLES['Italic']
+
+_DOC_TEMPLATE_KWARGS = dict(pagesize=A4, rightMargin=inch, leftMargin=inch, topMargin=inch, bottomMargin=inch)
+# ASCII translation table for filename sanitizing: keeps letters/digits/underscores, turns spaces into underscores
+# and deletes everything else, in a single str.translate pass.
+_SANITIZE_TABLE = {i: None for i in range(128) if not (chr(i).isalnum() or chr(i) == '_')}
+_SANITIZE_TABLE[ord(' ')] = '_'
+
+# Invoices with more items than this are rendered in a worker process instead of a thread
+_PROCESS_POOL_ITEM_THRESHOLD = 100
+_pdf_process_pool: Optional[ProcessPoolExecutor] = None # Started/stopped with the app, see start_pdf_process_pool()
+
+_ITEM_TABLE_HEADER = ['Description', 'Quantity', 'Unit Price', 'Total']
+_VECTORIZED_ROWS_THRESHOLD = 50 # Above this many items, the number columns are formatted with NumPy
+_ITEM_TABLE_COL_WIDTHS = [3*inch, 0.8*inch, 1*inch, 1*inch]
+_TOTALS_TABLE_COL_WIDTHS = [4.8*inch, 1.2*inch]
+
+_ITEM_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#ADD8E6')), # Light blue header
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F0F8FF')), # Alice blue rows
+    ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#C0C0C0')), # Silver grid lines
+    ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#808080')), # Grey box border
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'), # Align Qty, Unit Price, Total to right
+])
+
+_TOTALS_TABLE_STYLE = TableStyle([
+    ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+])
+
+def _item_table_rows(items: List[InvoiceItem]) -> List[List[str]]:
+    """
+    Builds the item table rows (description, quantity, unit price, total) as display strings.
+    Item totals are taken as-is, since autofill_invoice_data has already calculated them.
+    """
+    if len(items) <= _VECTORIZED_ROWS_THRESHOLD:
+        return [[item.description, f"{item.quantity:.2f}", f"${item.unit_price:.2f}", f"${item.total:.2f}"] for item in items]
+    count = len(items)
+    quantities = np.char.mod("%.2f", np.fromiter((item.quantity for item in items), dtype=np.float64, count=count))
+    unit_prices = np.char.mod("$%.2f", np.fromiter((item.unit_price for item in items), dtype=np.float64, count=count))
+    totals = np.char.mod("$%.2f", np.fromiter((item.total for item in items), dtype=np.float64, count=count))
+    return [list(row) for row in zip((item.description for item in items), quantities.tolist(), unit_prices.tolist(), totals.tolist())]
+
+def _sanitize_client_name(client_name: str) -> str:
+    """Reduces a client name to letters, digits and underscores (spaces become underscores) for use in filenames."""
+    if client_name.isascii():
+        return client_name.translate(_SANITIZE_TABLE)
+    # Non-ASCII names keep the Unicode-aware isalnum() check
+    return "".join(c for c in client_name if c.isalnum() or c in [' ', '_']).replace(' ', '_')
 
 def generate_invoice_pdf(invoice: InvoiceData) -> str:
     """
@@ -25,69 +95,46 @@ def generate_invoice_pdf(invoice: InvoiceData) -> str:
     Returns:
         str: The MinIO object name (path within the bucket) of the generated PDF.
     """
+    now = datetime.now() # Read the clock once for the invoice number and the object name
+
     if not invoice.invoice_number:
         # Generate a simple invoice number if not provided
-        invoice_number = f"INV-{invoice.invoice_date.replace('-', '') if invoice.invoice_date else datetime.now().strftime('%Y%m%d')}-{datetime.now().strftime('%H%M%S')}"
+        invoice_number = f"INV-{invoice.invoice_date.replace('-', '') if invoice.invoice_date else now.strftime('%Y%m%d')}-{now.strftime('%H%M%S')}"
         invoice.invoice_number = invoice_number
     else:
         invoice_number = invoice.invoice_number
 
     # Sanitize client name for filename
-    sanitized_client_name = "".join(c for c in invoice.client_name if c.isalnum() or c in [' ', '_']).replace(' ', '_') if invoice.client_name else "unknown_client"
+    sanitized_client_name = _sanitize_client_name(invoice.client_name) if invoice.client_name else "unknown_client"
     # Create a unique filename for the PDF in MinIO
-    pdf_object_name = f"invoice_{sanitized_client_name}_{invoice_number}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+    pdf_object_name = f"invoice_{sanitized_client_name}_{invoice_number}_{now.strftime('%Y%m%d%H%M%S')}.pdf"
 
     # Use BytesIO to create the PDF in memory
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4,
-                            rightMargin=inch, leftMargin=inch,
-                            topMargin=inch, bottomMargin=inch)
+    doc = SimpleDocTemplate(buffer, **_DOC_TEMPLATE_KWARGS)
     elements = []
-    styles = getSampleStyleSheet()
 
     # --- Header ---
-    elements.append(Paragraph("<b>INVOICE</b>", styles['h1']))
+    elements.append(Paragraph("<b>INVOICE</b>", _H1))
     elements.append(Spacer(1, 0.2 * inch))
-    elements.append(Paragraph(f"<b>Invoice #:</b> {invoice_number}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Date:</b> {invoice.invoice_date if invoice.invoice_date else 'N/A'}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Due Date:</b> {invoice.due_date if invoice.due_date else 'N/A'}", styles['Normal']))
+    elements.append(Paragraph(f"<b>Invoice #:</b> {invoice_number}", _NORMAL))
+    elements.append(Paragraph(f"<b>Date:</b> {invoice.invoice_date if invoice.invoice_date else 'N/A'}", _NORMAL))
+    elements.append(Paragraph(f"<b>Due Date:</b> {invoice.due_date if invoice.due_date else 'N/A'}", _NORMAL))
     elements.append(Spacer(1, 0.4 * inch))
 
     # --- Client Information ---
-    elements.append(Paragraph("<b>Bill To:</b>", styles['h3']))
+    elements.append(Paragraph("<b>Bill To:</b>", _H3))
     if invoice.client_name:
-        elements.append(Paragraph(invoice.client_name, styles['Normal']))
+        elements.append(Paragraph(invoice.client_name, _NORMAL))
     if invoice.client_address:
-        elements.append(Paragraph(invoice.client_address, styles['Normal']))
+        elements.append(Paragraph(invoice.client_address, _NORMAL))
     elements.append(Spacer(1, 0.4 * inch))
 
     # --- Items Table ---
     if invoice.items:
-        data = [['Description', 'Quantity', 'Unit Price', 'Total']]
-        for item in invoice.items:
-            # Ensure item totals are calculated if not present (though autofill_invoice_data handles this)
-            item_total = item.total if item.total is not None else (item.quantity * item.unit_price if item.quantity is not None and item.unit_price is not None else 0.0)
-            data.append([
-                item.description,
-                f"{item.quantity:.2f}",
-                f"${item.unit_price:.2f}",
-                f"${item_total:.2f}"
-            ])
-
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#ADD8E6')), # Light blue header
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F0F8FF')), # Alice blue rows
-            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#C0C0C0')), # Silver grid lines
-            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#808080')), # Grey box border
-            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'), # Align Qty, Unit Price, Total to right
-        ])
-
-        item_table = Table(data, colWidths=[3*inch, 0.8*inch, 1*inch, 1*inch])
-        item_table.setStyle(table_style)
+        data = [_ITEM_TABLE_HEADER] + _item_table_rows(invoice.items)
+        item_table = Table(data, colWidths=_ITEM_TABLE_COL_WIDTHS)
+        item_table.setStyle(_ITEM_TABLE_STYLE)
         elements.append(item_table)
         elements.append(Spacer(1, 0.2 * inch))
 
@@ -103,42 +150,83 @@ def generate_invoice_pdf(invoice: InvoiceData) -> str:
         [f"Tax ({tax_rate_display:.0f}%):", f"${tax_amount:.2f}"],
         ['Grand Total:', f"${grand_total:.2f}"]
     ]
-    totals_table = Table(totals_data, colWidths=[4.8*inch, 1.2*inch])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        ('TOPPADDING', (0, 0), (-1, -1), 4),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-    ]))
+    totals_table = Table(totals_data, colWidths=_TOTALS_TABLE_COL_WIDTHS)
+    totals_table.setStyle(_TOTALS_TABLE_STYLE)
     elements.append(totals_table)
     elements.append(Spacer(1, 0.3 * inch))
 
     # --- Notes ---
     if invoice.notes:
-        elements.append(Paragraph("<b>Notes:</b>", styles['h3']))
-        elements.append(Paragraph(invoice.notes, styles['Normal']))
+        elements.append(Paragraph("<b>Notes:</b>", _H3))
+        elements.append(Paragraph(invoice.notes, _NORMAL))
         elements.append(Spacer(1, 0.2 * inch))
 
     # --- Footer (Optional) ---
     elements.append(Spacer(1, 0.5 * inch))
-    elements.append(Paragraph("<i>Thank you for your business!</i>", styles['Italic']))
+    elements.append(Paragraph("<i>Thank you for your business!</i>", _ITALIC))
 
     # Build PDF in memory
     try:
         doc.build(elements)
+        pdf_size = buffer.getbuffer().nbytes # Size of the rendered PDF, independent of the stream position
         buffer.seek(0) # Reset buffer position to the beginning
 
         # Upload the PDF from memory to MinIO
-        minio_storage_service.upload_file(
+        get_minio().upload_file(
             bucket_name=MINIO_PDF_BUCKET,
             object_name=pdf_object_name,
             data=buffer,
-            length=buffer.tell(), # Get the current position (which is the file size)
+            length=pdf_size,
             content_type="application/pdf"
         )
-        print(f"Invoice PDF generated and uploaded to MinIO: {MINIO_PDF_BUCKET}/{pdf_object_name}")
+        logger.debug("Invoice PDF generated and uploaded to MinIO: %s/%s", MINIO_PDF_BUCKET, pdf_object_name)
         return pdf_object_name
     except Exception as e:
-        print(f"Error generating or uploading PDF: {e}")
+        logger.error("Error generating or uploading PDF: %s", e)
         raise RuntimeError(f"Failed to generate or upload PDF: {e}")
 
+def _generate_invoice_pdf_in_worker(invoice: InvoiceData) -> Tuple[str, Optional[str]]:
+    """
+    Entry point for the PDF worker processes. Changes made to the invoice in the worker are lost,
+    so the (possibly generated) invoice number is returned alongside the object name.
+    """
+    pdf_object_name = generate_invoice_pdf(invoice)
+    return pdf_object_name, invoice.invoice_number
+
+def start_pdf_process_pool(max_workers: Optional[int] = None) -> None:
+    """
+    Starts the process pool used for rendering large invoices. Called once from FastAPI's startup event.
+    Workers are spawned rather than forked, since the parent process may hold CUDA state.
+    """
+    global _pdf_process_pool
+    if _pdf_process_pool is None:
+        _pdf_process_pool = ProcessPoolExecutor(
+            max_workers=max_workers or min(4, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+def shutdown_pdf_process_pool() -> None:
+    """Stops the PDF process pool, if it was started."""
+    global _pdf_process_pool
+    if _pdf_process_pool is not None:
+        _pdf_process_pool.shutdown(wait=True, cancel_futures=True)
+        _pdf_process_pool = None
+
+async def generate_invoice_pdf_async(invoice: InvoiceData) -> str:
+    """
+    Runs generate_invoice_pdf off the event loop: in a worker thread for typical invoices,
+    or in the process pool for invoices with more than _PROCESS_POOL_ITEM_THRESHOLD items
+    (where ReportLab's pure-Python layout would otherwise hold the GIL for long).
+
+    Args:
+        invoice (InvoiceData): The Pydantic model containing invoice data.
+
+    Returns:
+        str: The MinIO object name (path within the bucket) of the generated PDF.
+    """
+    if _pdf_process_pool is not None and len(invoice.items) > _PROCESS_POOL_ITEM_THRESHOLD:
+        loop = asyncio.get_running_loop()
+        pdf_object_name, invoice_number = await loop.run_in_executor(_pdf_process_pool, _generate_invoice_pdf_in_worker, invoice)
+        invoice.invoice_number = invoice_number # Mirror the worker's update of the invoice number
+        return pdf_object_name
+    return await asyncio.to_thread(generate_invoice_pdf, invoice)
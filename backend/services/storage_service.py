@@ -1,10 +1,64 @@
 # backend/services/storage_service.py
 
+import functools
+import logging
 import os
+import socket
+import tempfile
 from io import BytesIO
+from typing import BinaryIO, Dict, Iterator, Optional, Union
+import certifi
+import urllib3
+from urllib3.connection import HTTPConnection
 from minio import Minio
 from minio.error import S3Error
-from backend.config import MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_SECURE, MINIO_AUDIO_BUCKET, MINIO_PDF_BUCKET
+from backend.config import MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY, MINIO_SECURE, MINIO_AUDIO_BUCKET, MINIO_PDF_BUCKET, MINIO_PRESIGNED_URL_EXPIRY
+
+logger = logging.getLogger(__name__)
+
+# Written once the buckets are known to exist, so further worker processes on this host skip the checks.
+# Its content records the endpoint and bucket names, so a config change triggers a fresh check.
+_BUCKETS_READY_SENTINEL = os.path.join(tempfile.gettempdir(), ".minio_buckets_ready")
+
+def _build_http_client() -> urllib3.PoolManager:
+    """
+    Builds the HTTP connection pool shared by all MinIO calls.
+    Sized for concurrent request handlers (the MinIO default keeps at most 10 connections per host),
+    with bounded retries/timeouts and TCP keep-alive so idle connections survive between requests.
+    """
+    return urllib3.PoolManager(
+        num_pools=16,
+        maxsize=64,
+        retries=urllib3.Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]),
+        timeout=urllib3.Timeout(connect=2, read=30),
+        # Same certificate handling as the MinIO client's default pool
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        # The urllib3 defaults already include TCP_NODELAY
+        socket_options=HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+    )
+
+# Objects larger than this are uploaded in MULTIPART_PART_SIZE parts with MULTIPART_PARALLEL_UPLOADS
+# parts in flight at once. Smaller objects keep the MinIO client's own part sizing and parallelism.
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_PART_SIZE = 5 * 1024 * 1024 # S3's minimum part size
+MULTIPART_PARALLEL_UPLOADS = 4
+
+class _BufferReader:
+    """
+    Minimal read()-only stream over a bytearray/memoryview, so uploads from such buffers
+    don't need an up-front copy of the whole buffer into a BytesIO.
+    Each read() still returns a bytes copy of its slice, as the MinIO client only accepts bytes parts.
+    """
+    def __init__(self, data: Union[bytearray, memoryview]):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        chunk = self._view[self._position:end].tobytes()
+        self._position = end
+        return chunk
 
 class MinIOStorageService:
     """
@@ -22,103 +76,173 @@ class MinIOStorageService:
                 access_key=MINIO_ACCESS_KEY,
                 secret_key=MINIO_SECRET_KEY,
                 secure=MINIO_SECURE,
-                # Set a higher timeout for potentially large file uploads/downloads
-                # or slow network conditions. Default is usually sufficient but good for large files.
-                # Timeout in seconds. Can be None for no timeout.
-                http_client=None # Use default http client, or provide custom
+                http_client=_build_http_client() # Tuned, persistent connection pool (see _build_http_client)
             )
-            print(f"MinIO client initialized for endpoint: {MINIO_ENDPOINT}, Secure: {MINIO_SECURE}")
+            logger.info("MinIO client initialized for endpoint: %s, Secure: %s", MINIO_ENDPOINT, MINIO_SECURE)
             self._ensure_buckets_exist()
         except Exception as e:
-            print(f"ERROR: Failed to initialize MinIO client: {e}")
+            logger.error("Failed to initialize MinIO client: %s", e)
             raise
 
     def _ensure_buckets_exist(self):
         """
         Ensures that the audio and PDF buckets exist. Creates them if they don't.
+        Skipped when another process on this host has already done so (see _BUCKETS_READY_SENTINEL).
         """
         buckets_to_create = [MINIO_AUDIO_BUCKET, MINIO_PDF_BUCKET]
+        sentinel_content = "\n".join([MINIO_ENDPOINT, *buckets_to_create])
+        try:
+            with open(_BUCKETS_READY_SENTINEL) as f:
+                if f.read() == sentinel_content:
+                    logger.info("MinIO buckets already verified by another process, skipping checks.")
+                    return
+        except OSError:
+            pass # No sentinel yet (or unreadable): check the buckets below
+
         for bucket_name in buckets_to_create:
             try:
                 if not self.client.bucket_exists(bucket_name):
                     self.client.make_bucket(bucket_name)
-                    print(f"MinIO bucket '{bucket_name}' created successfully.")
+                    logger.info("MinIO bucket '%s' created successfully.", bucket_name)
                 else:
-                    print(f"MinIO bucket '{bucket_name}' already exists.")
+                    logger.info("MinIO bucket '%s' already exists.", bucket_name)
             except S3Error as e:
-                print(f"ERROR: S3 Error ensuring bucket '{bucket_name}': {e}")
+                logger.error("S3 Error ensuring bucket '%s': %s", bucket_name, e)
                 raise
             except Exception as e:
-                print(f"ERROR: Unexpected error ensuring bucket '{bucket_name}': {e}")
+                logger.error("Unexpected error ensuring bucket '%s': %s", bucket_name, e)
                 raise
 
-    def upload_file(self, bucket_name: str, object_name: str, data: BytesIO, length: int, content_type: str = "application/octet-stream") -> str:
+        try:
+            with open(_BUCKETS_READY_SENTINEL, "w") as f:
+                f.write(sentinel_content)
+        except OSError as e:
+            # Not fatal: every process just keeps checking the buckets itself
+            logger.debug("Could not write bucket sentinel %s: %s", _BUCKETS_READY_SENTINEL, e)
+
+    def upload_file(self, bucket_name: str, object_name: str, data: Union[BinaryIO, bytes, bytearray, memoryview], length: int, content_type: str = "application/octet-stream", part_size: int = 0) -> str:
         """
-        Uploads a file (BytesIO object) to a specified MinIO bucket.
+        Uploads a file-like object (e.g. BytesIO or an UploadFile's spooled file) or an in-memory
+        bytes-like buffer to a specified MinIO bucket.
 
         Args:
             bucket_name (str): The name of the bucket.
             object_name (str): The desired name of the object in the bucket.
-            data (BytesIO): The file data as a BytesIO object.
-            length (int): The length of the data in bytes.
+            data (Union[BinaryIO, bytes, bytearray, memoryview]): A readable binary stream positioned at
+                the start of the data, or the data itself.
+            length (int): The length of the data in bytes, or -1 if unknown (requires part_size).
             content_type (str): The MIME type of the file.
+            part_size (int): Multipart chunk size in bytes; 0 lets the MinIO client choose,
+                except above MULTIPART_THRESHOLD, where MULTIPART_PART_SIZE parts are uploaded
+                MULTIPART_PARALLEL_UPLOADS at a time. Below it the client's default parallelism applies.
 
         Returns:
             str: The full path of the uploaded object (bucket_name/object_name).
         """
+        if isinstance(data, bytes):
+            data = BytesIO(data) # Shares the immutable bytes object's buffer, no up-front copy
+        elif isinstance(data, (bytearray, memoryview)):
+            data = _BufferReader(data)
+        multipart_options = {}
+        if length > MULTIPART_THRESHOLD:
+            # put_object switches to a multipart upload and sends the parts from a thread pool
+            part_size = part_size or MULTIPART_PART_SIZE
+            multipart_options["num_parallel_uploads"] = MULTIPART_PARALLEL_UPLOADS
         try:
             self.client.put_object(
                 bucket_name=bucket_name,
                 object_name=object_name,
                 data=data,
                 length=length,
-                content_type=content_type
+                content_type=content_type,
+                part_size=part_size,
+                **multipart_options
             )
-            print(f"Successfully uploaded {object_name} to bucket {bucket_name}")
+            logger.debug("Successfully uploaded %s to bucket %s", object_name, bucket_name)
             # Construct a downloadable URL (for MinIO, this usually implies access via its API/proxy)
             # For direct public access, you'd need presigned URLs or public buckets configured externally.
             # Here, we return a logical path that your FastAPI can use to retrieve.
             return f"{bucket_name}/{object_name}"
         except S3Error as e:
-            print(f"ERROR: S3 Error uploading {object_name} to {bucket_name}: {e}")
+            logger.error("S3 Error uploading %s to %s: %s", object_name, bucket_name, e)
             raise
         except Exception as e:
-            print(f"ERROR: Unexpected error uploading {object_name}: {e}")
+            logger.error("Unexpected error uploading %s: %s", object_name, e)
             raise
 
-    def download_file(self, bucket_name: str, object_name: str) -> BytesIO:
+    def stream_file(self, bucket_name: str, object_name: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
         """
-        Downloads a file from a specified MinIO bucket.
+        Opens a file in a specified MinIO bucket for streaming.
+        The GET request is issued immediately, so a missing object raises here,
+        while the body is only read chunk by chunk as the returned iterator is consumed.
 
         Args:
             bucket_name (str): The name of the bucket.
-            object_name (str): The name of the object to download.
+            object_name (str): The name of the object to stream.
+            chunk_size (int): Size in bytes of each chunk read from MinIO.
 
         Returns:
-            BytesIO: The file data as a BytesIO object.
+            Iterator[bytes]: The object's content in chunks.
         """
         try:
             response = self.client.get_object(bucket_name, object_name)
-            file_data = BytesIO(response.read())
-            file_data.seek(0) # Reset stream position to the beginning
-            response.close()
-            response.release_conn()
-            print(f"Successfully downloaded {object_name} from bucket {bucket_name}")
-            return file_data
         except S3Error as e:
             if e.code == "NoSuchKey":
-                print(f"ERROR: Object '{object_name}' not found in bucket '{bucket_name}'.")
+                logger.warning("Object '%s' not found in bucket '%s'.", object_name, bucket_name)
                 raise FileNotFoundError(f"Object '{object_name}' not found in bucket '{bucket_name}'.")
             else:
-                print(f"ERROR: S3 Error downloading {object_name} from {bucket_name}: {e}")
+                logger.error("S3 Error streaming %s from %s: %s", object_name, bucket_name, e)
                 raise
         except Exception as e:
-            print(f"ERROR: Unexpected error downloading {object_name}: {e}")
+            logger.error("Unexpected error streaming %s: %s", object_name, e)
+            raise
+        logger.debug("Streaming %s from bucket %s", object_name, bucket_name)
+        return self._iter_response(response, chunk_size)
+
+    @staticmethod
+    def _iter_response(response, chunk_size: int) -> Iterator[bytes]:
+        """
+        Yields a MinIO response body in chunks and releases the connection once done.
+        """
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.close()
+            response.release_conn()
+
+    def presigned_download_url(self, bucket_name: str, object_name: str, response_headers: Optional[Dict[str, str]] = None) -> str:
+        """
+        Generates a pre-signed GET URL so a client can download an object directly from MinIO.
+
+        Args:
+            bucket_name (str): The name of the bucket.
+            object_name (str): The name of the object to download.
+            response_headers (Optional[Dict[str, str]]): Response header overrides MinIO should apply,
+                e.g. {"response-content-type": "application/pdf"}.
+
+        Returns:
+            str: The pre-signed URL, valid for MINIO_PRESIGNED_URL_EXPIRY.
+        """
+        try:
+            return self.client.presigned_get_object(
+                bucket_name,
+                object_name,
+                expires=MINIO_PRESIGNED_URL_EXPIRY,
+                response_headers=response_headers
+            )
+        except S3Error as e:
+            logger.error("S3 Error generating pre-signed URL for %s in %s: %s", object_name, bucket_name, e)
+            raise
+        except Exception as e:
+            logger.error("Unexpected error generating pre-signed URL for %s: %s", object_name, e)
             raise
 
     def object_exists(self, bucket_name: str, object_name: str) -> bool:
         """
         Checks if an object exists in a specified MinIO bucket.
+        Costs a full round trip (stat_object), so don't use it in front of a download:
+        stream_file already raises FileNotFoundError for a missing object.
+        Intended for administrative and idempotency checks.
 
         Args:
             bucket_name (str): The name of the bucket.
@@ -134,12 +258,16 @@ class MinIOStorageService:
             if e.code == "NoSuchKey":
                 return False
             else:
-                print(f"ERROR: S3 Error checking existence of {object_name} in {bucket_name}: {e}")
+                logger.error("S3 Error checking existence of %s in %s: %s", object_name, bucket_name, e)
                 raise
         except Exception as e:
-            print(f"ERROR: Unexpected error checking existence of {object_name}: {e}")
+            logger.error("Unexpected error checking existence of %s: %s", object_name, e)
             raise
 
-# Instantiate the service globally or pass it around via dependency injection in FastAPI
-# For simplicity, we'll instantiate it here. FastAPI's Depends can be used for DI.
-minio_storage_service = MinIOStorageService()
+@functools.cache
+def get_minio() -> MinIOStorageService:
+    """
+    Returns the process-wide MinIOStorageService, creating it (and ensuring the buckets exist) on first call.
+    Importing this module has no network side effects; FastAPI's startup event calls this once up-front.
+    """
+    return MinIOStorageService()
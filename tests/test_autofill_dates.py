@@ -0,0 +1,22 @@
+# tests/test_autofill_dates.py
+
+from datetime import date, timedelta
+
+import pytest
+
+from backend.core.utils import autofill_invoice_data
+from backend.models import InvoiceData
+
+
+@pytest.mark.parametrize(
+    ("invoice_date", "expected_due_date"),
+    [("2025-07-04", "2025-08-03"), ("2025-7-4", "2025-08-03"), ("2025-12-5", "2026-01-04")],
+)
+def test_due_date_is_thirty_days_after_invoice_date(invoice_date, expected_due_date):
+    assert autofill_invoice_data(InvoiceData(invoice_date=invoice_date)).due_date == expected_due_date
+
+
+def test_invalid_invoice_date_falls_back_to_today():
+    invoice = autofill_invoice_data(InvoiceData(invoice_date="next tuesday"))
+    assert invoice.invoice_date == "next tuesday"
+    assert invoice.due_date == (date.today() + timedelta(days=30)).isoformat()
@@ -0,0 +1,39 @@
+# tests/test_autofill_matching.py
+
+import pytest
+
+from backend import config
+from backend.core.utils import _find_item_key, _match_item
+
+# "pen" comes first in DB order, but "pen drive" is the more specific item
+OVERLAPPING_KEYS = ("pen", "pen drive", "drive", "usb")
+RANKED_KEYS = tuple(sorted(OVERLAPPING_KEYS, key=len, reverse=True))
+
+
+def _automaton_backend():
+    if config.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    return {"automaton": config._build_item_automaton(RANKED_KEYS)}
+
+
+def _regex_backend():
+    return {"pattern": config._build_item_pattern(RANKED_KEYS), "key_ranks": {k: i for i, k in enumerate(RANKED_KEYS)}}
+
+
+@pytest.mark.parametrize("backend", [_automaton_backend, _regex_backend], ids=["aho-corasick", "regex"])
+@pytest.mark.parametrize("description, expected", [
+    ("pen drive 64gb", "pen drive"),
+    ("usb pen drive", "pen drive"), # Leftmost hit is "usb", longest is "pen drive"
+    ("drive and pen", "drive"),
+    ("usb pen", "pen"), # Equal lengths: DB order ("pen" before "usb")
+    ("blue pen", "pen"),
+    ("stapler", None),
+])
+def test_backends_pick_the_same_item_for_overlapping_keys(backend, description, expected):
+    assert _find_item_key(description, **backend()) == expected
+
+
+def test_match_item_uses_db_entry():
+    assert _match_item("wireless mouse") is config.item_db_normalized["mouse"]
+    assert _match_item("annual software license") is config.item_db_normalized["software license"]
+    assert _match_item("stapler") is None
@@ -0,0 +1,39 @@
+# tests/test_llm_audio.py
+
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("librosa")
+soundfile = pytest.importorskip("soundfile")
+
+from backend.services import llm_service
+
+
+def test_load_audio_decodes_wav_from_memory_and_resamples():
+    wav = BytesIO()
+    soundfile.write(wav, np.zeros((8000, 2), dtype=np.float32), 8000, format="WAV")
+    wav.seek(0)
+    audio = llm_service._load_audio(wav, 16000)
+    assert audio.ndim == 1
+    assert abs(len(audio) - 16000) <= 1
+
+
+def test_load_audio_passes_undecodable_streams_to_librosa_as_a_path(monkeypatch):
+    seen = {}
+
+    def fake_librosa_load(path, sr):
+        assert isinstance(path, str) # audioread is only tried for paths
+        with open(path, "rb") as f:
+            seen["data"] = f.read()
+        return np.zeros(sr, dtype=np.float32), sr
+
+    monkeypatch.setattr(llm_service.librosa, "load", fake_librosa_load)
+    source = BytesIO(b"\x1aE\xdf\xa3 not something libsndfile can read")
+    source.read(4) # soundfile may leave the stream partially consumed
+    audio = llm_service._load_audio(source, 16000)
+    assert seen["data"] == source.getvalue()
+    assert len(audio) == 16000
@@ -0,0 +1,55 @@
+# tests/test_llm_batching.py
+
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from backend.services import llm_service
+
+
+class _FakeModel:
+    """Records each generate() call and echoes the prompt followed by a closed JSON object."""
+    def __init__(self):
+        self.generation_config = SimpleNamespace(pad_token_id=0)
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        self.calls.append((threading.current_thread().name, input_ids.shape[0]))
+        reply = torch.tensor([[ord(c) for c in "{}"]] * input_ids.shape[0])
+        return torch.cat([input_ids, reply], dim=1)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = _FakeModel()
+    monkeypatch.setattr(llm_service, "qwen2_audio_model", model)
+    monkeypatch.setattr(llm_service, "qwen2_audio_processor", SimpleNamespace(tokenizer=SimpleNamespace(decode=chr)))
+    monkeypatch.setattr(llm_service, "use_bf16", False)
+    monkeypatch.setattr(llm_service, "_batch_worker", None)
+    return model
+
+
+def test_concurrent_requests_share_one_generate_call_on_the_generate_thread(fake_model):
+    async def submit_all():
+        requests = [
+            {"input_ids": torch.tensor([[5] * length]), "attention_mask": torch.ones(1, length, dtype=torch.long)}
+            for length in (3, 5)
+        ]
+        results = await asyncio.gather(*(llm_service.generate_batched(inputs) for inputs in requests))
+        llm_service._batch_worker.cancel()
+        return results
+
+    results = asyncio.run(submit_all())
+
+    assert len(fake_model.calls) == 1
+    thread_name, batch_size = fake_model.calls[0]
+    assert thread_name.startswith("qwen2-generate")
+    assert batch_size == 2
+    for generated_ids, prompt_len in results:
+        assert prompt_len == 5 # Shorter prompt is left-padded to the batch length
+        assert "".join(map(chr, generated_ids[0, prompt_len:].tolist())) == "{}"
@@ -0,0 +1,54 @@
+# tests/test_llm_json_scanning.py
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from backend.services.llm_service import BraceBalance, _find_json
+
+
+class _CharTokenizer:
+    """Decodes each token id as a single character, so token ids are just code points."""
+    def decode(self, token_id):
+        return chr(token_id)
+
+
+LLM_OUTPUT = (
+    'Sure, here is the "invoice" you asked for:\n'
+    '```json\n'
+    '{"client_name": "ACME {Corp}", "notes": "say \\"}\\" twice", "items": [{"description": "Laptop"}]}\n'
+    '```\n'
+    'Extra object: {"ignored": true}'
+)
+
+
+def _run_until_stop(texts, prompt_len=3):
+    """Feeds one character per step to BraceBalance and returns each row's generated text when it stopped."""
+    criterion = BraceBalance(_CharTokenizer(), prompt_len)
+    rows = [[0] * prompt_len for _ in texts]
+    stopped_at = [None] * len(texts)
+    for step in range(max(len(text) for text in texts)):
+        for row, text in enumerate(texts):
+            rows[row].append(ord(text[step]) if step < len(text) else 0)
+        done = criterion(torch.tensor(rows), None)
+        for row, is_done in enumerate(done.tolist()):
+            if is_done and stopped_at[row] is None:
+                stopped_at[row] = texts[row][:step + 1]
+        if all(done.tolist()):
+            break
+    return stopped_at
+
+
+def test_find_json_returns_first_balanced_object():
+    assert _find_json(LLM_OUTPUT) == '{"client_name": "ACME {Corp}", "notes": "say \\"}\\" twice", "items": [{"description": "Laptop"}]}'
+    assert _find_json("no object here") is None
+
+
+def test_brace_balance_stops_where_find_json_ends():
+    other_output = 'Result: {"client_name": "John Doe"} and {"x": 1}'
+    stopped_at = _run_until_stop([LLM_OUTPUT, other_output])
+    for text, generated in zip([LLM_OUTPUT, other_output], stopped_at):
+        assert generated is not None
+        assert generated.endswith(_find_json(text))
+        assert _find_json(generated) == _find_json(text)
@@ -0,0 +1,16 @@
+# tests/test_llm_loading.py
+
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from backend.services import llm_service
+
+
+def test_missing_bitsandbytes_fails_loudly_instead_of_loading_unquantized(monkeypatch):
+    monkeypatch.setitem(sys.modules, "bitsandbytes", None) # Makes `import bitsandbytes` raise ImportError
+    with pytest.raises(RuntimeError, match="bitsandbytes"):
+        llm_service._build_quantization_config()
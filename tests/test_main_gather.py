@@ -0,0 +1,32 @@
+# tests/test_main_gather.py
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+from backend.main import _gather_or_cancel
+
+
+def test_failed_awaitable_cancels_its_sibling():
+    async def scenario():
+        sibling_started = asyncio.Event()
+        sibling_cancelled = asyncio.Event()
+
+        async def failing_upload():
+            await sibling_started.wait()
+            raise RuntimeError("upload failed")
+
+        async def long_extraction():
+            sibling_started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                sibling_cancelled.set()
+                raise
+
+        with pytest.raises(RuntimeError, match="upload failed"):
+            await _gather_or_cancel(failing_upload(), long_extraction())
+        await asyncio.wait_for(sibling_cancelled.wait(), timeout=1)
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+# tests/test_main_invoice_body.py
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+from backend import main, models
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def fake_generate_invoice_pdf_async(invoice_data):
+        return "invoice_test.pdf"
+
+    monkeypatch.setattr(main, "generate_invoice_pdf_async", fake_generate_invoice_pdf_async)
+    return TestClient(main.app) # Not entered as a context manager, so startup (MinIO, LLM) doesn't run
+
+
+def test_invoice_from_data_computes_totals_only_in_autofill(client, monkeypatch):
+    def fail_compute_totals(items):
+        raise AssertionError("totals were computed on validation")
+
+    monkeypatch.setattr(models, "_compute_totals", fail_compute_totals)
+    response = client.post("/generate_invoice_from_data/", json={
+        "client_name": "Somebody",
+        "items": [{"description": "Thing", "quantity": 0.5, "unit_price": 25.05}],
+        "tax_rate": 0,
+    })
+    assert response.status_code == 200
+    invoice = response.json()["invoice_data"]
+    assert invoice["items"][0]["total"] == 12.53
+    assert invoice["subtotal"] == invoice["grand_total"] == 12.53
+
+
+def test_invalid_invoice_body_is_a_422(client):
+    response = client.post("/generate_invoice_from_data/", json={"items": [{"description": "Thing", "quantity": 0, "unit_price": 1}]})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "items", 0, "quantity"]
+
+
+def test_invoice_body_schema_is_documented(client):
+    operation = client.get("/openapi.json").json()["paths"]["/generate_invoice_from_data/"]["post"]
+    schema = operation["requestBody"]["content"]["application/json"]["schema"]
+    assert "items" in schema["properties"]
@@ -0,0 +1,54 @@
+# tests/test_models_totals.py
+
+import random
+
+import pytest
+
+from backend.core.utils import autofill_invoice_data
+from backend.models import InvoiceData, InvoiceItem
+
+
+def _items(count, seed=7):
+    rng = random.Random(seed)
+    return [
+        {"description": f"item {i}", "quantity": rng.choice([1, 2, 3, 0.5, 1.25]), "unit_price": round(rng.uniform(0.01, 999.99), 2)}
+        for i in range(count)
+    ]
+
+
+def _assert_consistent(invoice):
+    for item in invoice.items:
+        assert abs(item.total - item.quantity * item.unit_price) <= 0.005 + 1e-9 # Rounded to the nearest cent
+    assert invoice.subtotal == round(sum(item.total for item in invoice.items), 2)
+    assert invoice.grand_total == round(invoice.subtotal + invoice.tax_amount, 2)
+
+
+@pytest.mark.parametrize("count", [1, 3, 250])
+def test_validation_and_autofill_agree_on_totals(count):
+    payload = {"client_name": "Somebody", "items": _items(count), "tax_rate": 0.08}
+    validated = InvoiceData.model_validate(payload)
+    autofilled = autofill_invoice_data(InvoiceData.model_validate(payload, context={"defer_totals": True}))
+
+    _assert_consistent(validated)
+    _assert_consistent(autofilled)
+    assert [item.total for item in validated.items] == [item.total for item in autofilled.items]
+    assert (validated.subtotal, validated.tax_amount, validated.grand_total) == (autofilled.subtotal, autofilled.tax_amount, autofilled.grand_total)
+
+
+def test_standalone_item_uses_same_rounding():
+    item = InvoiceItem(description="Mouse", quantity=3, unit_price=25.005)
+    invoice = InvoiceData(items=[{"description": "Mouse", "quantity": 3, "unit_price": 25.005}])
+    assert item.total == invoice.items[0].total
+
+
+@pytest.mark.parametrize(
+    ("quantity", "unit_price", "expected_total"),
+    [(0.5, 25.05, 12.53), (1.5, 150.01, 225.01), (3, 25.005, 75.02), (2, 19.99, 39.98)],
+)
+def test_item_totals_match_round_to_cents(quantity, unit_price, expected_total):
+    payload = {"items": [{"description": "Thing", "quantity": quantity, "unit_price": unit_price}], "tax_rate": 0}
+    assert InvoiceItem(**payload["items"][0]).total == expected_total
+    assert InvoiceData.model_validate(payload).items[0].total == expected_total
+    autofilled = autofill_invoice_data(InvoiceData.model_validate(payload, context={"defer_totals": True}))
+    assert autofilled.items[0].total == expected_total
+    assert autofilled.subtotal == expected_total
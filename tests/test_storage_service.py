@@ -0,0 +1,48 @@
+# tests/test_storage_service.py
+
+import pytest
+
+pytest.importorskip("minio")
+from minio.helpers import read_part_data
+
+from backend.services.storage_service import _BufferReader
+
+
+def test_buffer_reader_yields_bytes_parts_for_minio():
+    reader = _BufferReader(memoryview(bytearray(b"0123456789")))
+    assert read_part_data(reader, 4) == b"0123"
+    assert read_part_data(reader, 4) == b"4567"
+    assert read_part_data(reader, 4) == b"89"
+    assert read_part_data(reader, 4) == b""
+
+
+
+class _RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def put_object(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+@pytest.mark.parametrize("length", [1024, 6 * 1024 * 1024])
+def test_small_uploads_keep_minio_default_parallelism(length):
+    from backend.services.storage_service import MinIOStorageService
+
+    service = MinIOStorageService.__new__(MinIOStorageService)
+    service.client = _RecordingClient()
+    service.upload_file("bucket", "object", b"x", length)
+    call = service.client.calls[0]
+    assert "num_parallel_uploads" not in call
+    assert call["part_size"] == 0
+
+
+def test_large_uploads_send_minimum_size_parts_in_parallel():
+    from backend.services.storage_service import MULTIPART_PARALLEL_UPLOADS, MULTIPART_PART_SIZE, MinIOStorageService
+
+    service = MinIOStorageService.__new__(MinIOStorageService)
+    service.client = _RecordingClient()
+    service.upload_file("bucket", "object", b"x", 64 * 1024 * 1024)
+    call = service.client.calls[0]
+    assert call["num_parallel_uploads"] == MULTIPART_PARALLEL_UPLOADS
+    assert call["part_size"] == MULTIPART_PART_SIZE